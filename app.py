@@ -2,13 +2,20 @@ import os
 import glob
 import json
 import time
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import mimetypes
+import threading
+from flask import Flask, render_template, request, jsonify, send_from_directory, abort
 from PIL.PngImagePlugin import PngInfo
 
 # Import your existing engine
 from src.mochi_gallery.client import get_client, fetch_haiku, generate_image_prompt, generate_image_native, get_design_directives
 from src.mochi_gallery.painter import render_poster
-from src.mochi_gallery.gallery_utils import update_gallery_manifest
+from src.mochi_gallery.gallery_utils import update_gallery_manifest, manifest_version, POSTER_NAME_RE, CHUNK_NAME_RE, ASSET_NAME_RE
+from src.mochi_gallery import catalog
+from src.mochi_gallery.blocks import parse_block_bounds
+from src.mochi_gallery.singleflight import SingleFlight
+from src.mochi_gallery.bulk import apply_bulk, clean_paths, BulkError
+from src.mochi_gallery.storage import write_unique, encode_png, output_dirs, safe_relpath, trash_dir_for, store_for, MOSAIC_DIR
 
 app = Flask(__name__)
 
@@ -17,6 +24,74 @@ OUTPUT_DIR = os.path.join(os.getcwd(), 'output')
 STYLE_DIR = os.path.join(os.getcwd(), 'assets', 'styles')
 os.makedirs(os.path.join(OUTPUT_DIR, 'raw'), exist_ok=True)
 
+# --- CACHING POLICY ---
+# Poster filenames are never reused, not even after a purge (see
+# storage.write_unique and purge_file), gallery data chunks are named after
+# their catalog version and the viewer's static assets after their content,
+# so all of them can be cached forever. The gallery page and its chunk
+# index revalidate via ETag. Mosaics are rebuilt in place under fixed names
+# (mosaic.png, mosaic_001.png, ...), so they always revalidate.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_EXTS = {'.png', '.jpg', '.jpeg', '.webp', '.avif'}
+MUTABLE_DIRS = {MOSAIC_DIR}
+
+# Everything else in OUTPUT_DIR (the catalog database with its prompts,
+# .mochi.json, purge ledgers...) is never served
+SERVED_EXTS = IMMUTABLE_EXTS | {'.js', '.css', '.html'}
+
+# Optional byte offload to a front proxy:
+#   MOCHI_SENDFILE=x-sendfile  -> Apache/lighttpd X-Sendfile (absolute path)
+#   MOCHI_SENDFILE=x-accel     -> nginx X-Accel-Redirect to MOCHI_ACCEL_PREFIX/<path>
+#                                 (an 'internal' location aliased to OUTPUT_DIR)
+SENDFILE_MODE = os.getenv("MOCHI_SENDFILE", "").lower()
+ACCEL_PREFIX = os.getenv("MOCHI_ACCEL_PREFIX", "/protected-output")
+app.config['USE_X_SENDFILE'] = (SENDFILE_MODE == "x-sendfile")
+
+# Largest page a single /api/gallery or /api/search call may return
+SEARCH_MAX_LIMIT = 200
+
+# --- UPSTREAM COALESCING ---
+# Concurrent requests for the same haiku, or the same generation, share one
+# upstream call. Mined haiku never change, so they are cached for a while
+# (empty answers are not: the block may simply not exist yet). Finished
+# generations are kept briefly so double submits and other tabs get the
+# same poster instead of paying for another Imagen call.
+HAIKU_TTL = float(os.getenv("MOCHI_HAIKU_TTL", 600))
+GENERATE_TTL = float(os.getenv("MOCHI_GENERATE_TTL", 15))
+haiku_flight = SingleFlight(ttl=HAIKU_TTL, cache_if=lambda haiku: bool(haiku) and "no haiku" not in haiku.lower())
+generate_flight = SingleFlight(ttl=GENERATE_TTL)
+
+def get_haiku(block_num):
+    return haiku_flight.do(block_num, fetch_haiku, block_num)
+
+_gallery_state = {"version": None}
+_gallery_lock = threading.Lock()
+
+def apply_cache_policy(response, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    name = os.path.basename(filename)
+    immutable = ext in IMMUTABLE_EXTS or CHUNK_NAME_RE.match(name) or ASSET_NAME_RE.match(name)
+    if filename.replace('\\', '/').split('/', 1)[0] in MUTABLE_DIRS: immutable = False
+    if immutable and response.status_code in (200, 304):
+        response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def send_output_file(filename):
+    """Serves a media or viewer file from OUTPUT_DIR, honouring the sendfile offload setting."""
+    if os.path.splitext(filename)[1].lower() not in SERVED_EXTS: abort(404)
+    if SENDFILE_MODE == "x-accel":
+        rel_path = safe_relpath(filename)
+        if not rel_path or not os.path.isfile(os.path.join(OUTPUT_DIR, *rel_path.split('/'))):
+            abort(404)
+        response = app.response_class()
+        response.headers["X-Accel-Redirect"] = f"{ACCEL_PREFIX.rstrip('/')}/{rel_path}"
+        response.headers["Content-Type"] = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+    else:
+        response = send_from_directory(OUTPUT_DIR, filename)
+    return apply_cache_policy(response, filename)
+
 def get_styles():
     styles = []
     files = glob.glob(os.path.join(STYLE_DIR, "*.json"))
@@ -35,23 +110,70 @@ def index():
     """Render the Generator Interface"""
     return render_template('generator.html', styles=get_styles())
 
-@app.route('/gallery')
+# Trailing slash (Flask redirects /gallery here) so the page's relative
+# data URLs resolve under /gallery/
+@app.route('/gallery/')
 def gallery():
-    """Serve your existing static gallery with NO CACHE"""
-    # Ensure gallery is up to date
-    update_gallery_manifest(OUTPUT_DIR)
-    
-    # Serve the file but force browser to not cache it
-    response = send_from_directory(OUTPUT_DIR, 'index.html')
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
+    """Serve the static gallery, revalidated via an ETag of the manifest version"""
+    version = manifest_version(OUTPUT_DIR)
+    if request.if_none_match.contains(version):
+        response = app.response_class(status=304)
+    else:
+        # Only rebuild the page when the posters actually changed
+        with _gallery_lock:
+            if version != _gallery_state["version"] or not os.path.exists(os.path.join(OUTPUT_DIR, 'index.html')):
+                update_gallery_manifest(OUTPUT_DIR)
+                _gallery_state["version"] = version
+        response = send_from_directory(OUTPUT_DIR, 'index.html', conditional=False)
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def page_args():
+    """(blocks, limit, offset) from the query string; raises ValueError if malformed."""
+    blocks = parse_block_bounds(request.args.get('blocks'))
+    limit = min(max(int(request.args.get('limit', 50)), 1), SEARCH_MAX_LIMIT)
+    offset = max(int(request.args.get('offset', 0)), 0)
+    return blocks, limit, offset
+
+@app.route('/api/gallery')
+def gallery_page():
+    """One page of the manifest: /api/gallery?style=Zen&blocks=800000-880000&limit=200&offset=0"""
+    version = manifest_version(OUTPUT_DIR)
+    if request.if_none_match.contains(version):
+        response = app.response_class(status=304)
+    else:
+        try:
+            blocks, limit, offset = page_args()
+        except ValueError:
+            return jsonify({"error": "Invalid blocks, limit or offset"}), 400
+        styles = request.args.getlist('style')
+        items = catalog.query_renders(OUTPUT_DIR, style=styles, blocks=blocks, limit=limit, offset=offset)
+        total = catalog.count_renders(OUTPUT_DIR, style=styles, blocks=blocks)
+        response = jsonify({"items": items, "total": total, "limit": limit, "offset": offset})
+    # Pages only change with the catalog, so the manifest version is a valid ETag
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route('/api/search')
+def search_gallery():
+    """Ranked haiku search: /api/search?q=moon&style=Zen&blocks=800000-880000&limit=50&offset=0"""
+    try:
+        blocks, limit, offset = page_args()
+    except ValueError:
+        return jsonify({"error": "Invalid blocks, limit or offset"}), 400
+
+    items, total = catalog.search(OUTPUT_DIR, request.args.get('q', ''), style=request.args.getlist('style'),
+                                  blocks=blocks, limit=limit, offset=offset)
+    response = jsonify({"items": items, "total": total, "limit": limit, "offset": offset})
+    response.headers["Cache-Control"] = "no-cache"
     return response
 
 @app.route('/gallery/<path:filename>')
 def serve_gallery_assets(filename):
     """Handle relative path requests from the gallery page (images inside output)"""
-    return send_from_directory(OUTPUT_DIR, filename)
+    return send_output_file(filename)
 
 @app.route('/assets/<path:filename>')
 def serve_assets(filename):
@@ -61,13 +183,13 @@ def serve_assets(filename):
 @app.route('/output/<path:filename>')
 def serve_output(filename):
     """Serve images for the Generator preview"""
-    return send_from_directory(OUTPUT_DIR, filename)
+    return send_output_file(filename)
 
 @app.route('/api/haiku', methods=['POST'])
 def get_haiku_text():
     block_num = request.form.get('block_num')
     try:
-        haiku = fetch_haiku(int(block_num))
+        haiku = get_haiku(int(block_num))
         if not haiku or "no haiku" in haiku.lower():
             return "<div class='text-red-500'>No Haiku found for this block.</div>"
         return f"<div class='haiku-preview'>{haiku}</div>"
@@ -85,9 +207,15 @@ def generate():
     model = request.form.get('model')
     ar = request.form.get('ar')
     text_model = request.form.get('text_model')
-    
+
+    key = (block_num, style_id_1 or "none", style_id_2 or "none", ar, model, text_model)
+    filename, prompt = generate_flight.do(key, run_generation, block_num, style_id_1, style_id_2, model, ar, text_model)
+    return render_template('partial_result.html', filename=filename, prompt=prompt)
+
+def run_generation(block_num, style_id_1, style_id_2, model, ar, text_model):
+    """Prompt, image, design, render and save for one block; returns (filename, prompt)."""
     client = get_client()
-    haiku = fetch_haiku(block_num)
+    haiku = get_haiku(block_num)
     
     # --- STYLE MERGING LOGIC ---
     style_data = None
@@ -142,7 +270,6 @@ def generate():
     # Save
     style_prefix = "_".join(active_styles) if active_styles else "custom"
     filename = f"{style_prefix}_block_{block_num}_{int(time.time())}.png"
-    save_path = os.path.join(OUTPUT_DIR, filename)
     
     meta = PngInfo()
     meta.add_text("Haiku", haiku)
@@ -150,28 +277,38 @@ def generate():
     if style_data:
         meta.add_text("Style", style_data.get("style_name", "Custom"))
         
-    poster.save(save_path, pnginfo=meta)
-    
-    return render_template('partial_result.html', filename=filename, prompt=prompt)
+    # O_EXCL allocation: two generations in the same second get distinct files
+    poster_dir, _ = output_dirs(OUTPUT_DIR, block_num)
+    save_path, _ = write_unique(poster_dir, filename, encode_png(poster, meta),
+                                reserved_dirs=[trash_dir_for(OUTPUT_DIR, poster_dir)], store=store_for(OUTPUT_DIR))
+    # Relative to OUTPUT_DIR so /output/<path> works for sharded layouts
+    filename = os.path.relpath(save_path, OUTPUT_DIR).replace(os.sep, '/')
+    catalog.record_render(OUTPUT_DIR, filename, block_num, haiku,
+                          style=style_data.get("style_name") if style_data else None,
+                          model=model, text_model=text_model, prompt=prompt, size=poster.size)
+    return filename, prompt
 
 # --- NEW ROUTE: Soft Delete ---
 @app.route('/delete', methods=['POST'])
 def delete_artifact():
-    filename = request.form.get('filename')
-    
-    # Security: Prevent directory traversal
-    if not filename or '..' in filename or '/' in filename:
+    # Security: only posters may be trashed; clean_paths rejects traversal and
+    # reserved directories (raw, trash, blobs, gallery data...), and anything
+    # else must look like a poster or be one in the catalog
+    try: filename, = clean_paths([request.form.get('filename') or ''])
+    except BulkError: return "Invalid filename", 400
+    if not POSTER_NAME_RE.match(filename.rsplit('/', 1)[-1]) and not catalog.select_paths(OUTPUT_DIR, [filename]):
         return "Invalid filename", 400
 
-    src_path = os.path.join(OUTPUT_DIR, filename)
-    trash_dir = os.path.join(OUTPUT_DIR, 'deleted')
-    os.makedirs(trash_dir, exist_ok=True)
-    dst_path = os.path.join(trash_dir, filename)
+    src_path = os.path.join(OUTPUT_DIR, *filename.split('/'))
+    # Keep the shard structure inside the trash so restores are unambiguous
+    dst_path = os.path.join(OUTPUT_DIR, 'deleted', *filename.split('/'))
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
 
     if os.path.exists(src_path):
         try:
             # Move file to trash
             os.rename(src_path, dst_path)
+            catalog.mark_deleted(OUTPUT_DIR, [filename])
             # Rebuild gallery.json immediately
             update_gallery_manifest(OUTPUT_DIR)
             return "OK", 200
@@ -180,6 +317,38 @@ def delete_artifact():
     else:
         return "File not found", 404
 
+@app.route('/api/bulk', methods=['POST'])
+def bulk_artifacts():
+    """
+    Batch delete/restore/purge/restyle, e.g.
+        {"op": "delete", "paths": ["block_1.png", "0/block_2.png"]}
+        {"op": "restore", "style": "Ghibli", "blocks": "800000-801000"}
+        {"op": "restyle", "paths": [...], "to_style": "Noir"}
+    """
+    body = request.get_json(silent=True)
+    if body is None: body = {}
+    try:
+        if not isinstance(body, dict): raise BulkError("Request body must be a JSON object")
+        paths = body.get('paths')
+        if paths is not None and not (isinstance(paths, list) and all(isinstance(p, str) for p in paths)):
+            raise BulkError("paths must be a list of strings")
+        style = body.get('style')
+        if style is not None and not (isinstance(style, str) or (isinstance(style, list) and all(isinstance(s, str) for s in style))):
+            raise BulkError("style must be a string or a list of strings")
+        for key in ('op', 'blocks', 'to_style'):
+            if body.get(key) is not None and not isinstance(body[key], str): raise BulkError(f"{key} must be a string")
+        blocks = parse_block_bounds(body.get('blocks'))
+        result = apply_bulk(OUTPUT_DIR, body.get('op'), paths=paths, style=style,
+                            blocks=blocks, to_style=body.get('to_style'))
+    except (BulkError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except OSError as e:
+        return jsonify({"error": str(e)}), 500
+
+    # One manifest rebuild for the whole batch
+    if result["done"]: update_gallery_manifest(OUTPUT_DIR)
+    return jsonify(result)
+
 if __name__ == '__main__':
     print("Starting Flask Server...")
     app.run(debug=True, port=5000, host='0.0.0.0')
@@ -0,0 +1,90 @@
+"""
+CLI startup benchmark.
+
+    python benchmarks/startup.py [--runs 10] [--budget-ms 100]
+
+Runs the lightweight commands in fresh interpreters, checks under
+`python -X importtime` that none of them imports a heavy dependency, and
+compares the median wall time with the budget. Exits non-zero on failure.
+Run from the repository root (the 'list' command reads assets/styles).
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only the render pipeline may pull these in
+HEAVY_MODULES = ("google", "PIL", "pydantic", "requests", "httpx", "dotenv", "numpy")
+
+def commands(output_dir):
+    return {
+        "list": ["list"],
+        "gallery": ["gallery", "--output", output_dir],
+        "inspect": ["inspect", "880030", "--output", output_dir],
+        "--help": ["--help"],
+    }
+
+def run_cli(argv, importtime=False):
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"))
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run([sys.executable, *flags, "-m", "mochi_gallery.cli", *argv],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+
+def parse_importtime(stderr):
+    """[(module, cumulative_us)] from `-X importtime` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _self_us, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(cumulative)))
+    return imports
+
+def is_heavy(module):
+    return any(module == heavy or module.startswith(heavy + ".") for heavy in HEAVY_MODULES)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mochi-gallery CLI startup")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs per command")
+    parser.add_argument("--budget-ms", type=float, default=100, help="Maximum median wall time per command")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as output_dir:
+        print(f"{'COMMAND':<10} | {'MEDIAN':>9} | {'IMPORTS':>9} | SLOWEST IMPORTS")
+        print("-" * 78)
+        for name, argv in commands(output_dir).items():
+            traced = run_cli(argv, importtime=True)
+            if traced.returncode != 0:
+                print(f"{name:<10} | failed: {traced.stderr.strip().splitlines()[-1]}")
+                failed = True
+                continue
+            imports = parse_importtime(traced.stderr)
+            heavy = sorted({module.split(".")[0] for module, _ in imports if is_heavy(module)})
+
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                run_cli(argv)
+                timings.append((time.perf_counter() - start) * 1000)
+            median = statistics.median(timings)
+
+            top_level = [(m, us) for m, us in imports if "." not in m]
+            slowest = ", ".join(f"{m} {us / 1000:.1f}ms" for m, us in sorted(top_level, key=lambda x: -x[1])[:3])
+            print(f"{name:<10} | {median:>7.1f}ms | {len(imports):>9} | {slowest}")
+
+            if heavy:
+                print(f"{'':<10}   [FAIL] imports heavy dependencies: {', '.join(heavy)}")
+                failed = True
+            if median > args.budget_ms:
+                print(f"{'':<10}   [FAIL] over the {args.budget_ms:.0f}ms budget")
+                failed = True
+        print("-" * 78)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import asyncio
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from google.genai import types
+from .client import (
+    MOCHISAN_API_URL, MODEL_MAP, block_payload, build_prompt_request, mock_image, decode_image,
+    fallback_design, design_request, design_config,
+)
+from .painter import render_poster
+from .storage import encode_png
+
+# Default in-flight limits per upstream service
+DEFAULT_LIMITS = {"mochiscan": 32, "text": 16, "image": 8}
+
+class AsyncClient:
+    """
+    asyncio counterpart of client.py. One instance drives many concurrent
+    blocks from a single thread:
+
+        async with AsyncClient(genai_client) as ac:
+            haiku = await ac.fetch_haiku(880030)
+
+    Each upstream service has its own semaphore, so a slow Imagen queue does
+    not stop haiku fetches or prompt writing. CPU stages (decode, render,
+    PNG encode) run on an executor so they never block the event loop.
+    Unlike the sync client, failures raise instead of calling sys.exit, so
+    one bad block does not take down the whole batch.
+    """
+
+    def __init__(self, client, limits=None, executor=None):
+        self.client = client
+        limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.limits = {name: asyncio.Semaphore(n) for name, n in limits.items()}
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=limits["image"])
+        self.http = httpx.AsyncClient(timeout=10, limits=httpx.Limits(max_connections=limits["mochiscan"]))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.http.aclose()
+        if self._own_executor: self.executor.shutdown(wait=False)
+
+    async def run_cpu(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def fetch_haiku(self, block_number: int) -> str:
+        async with self.limits["mochiscan"]:
+            try:
+                resp = await self.http.post(MOCHISAN_API_URL, json=block_payload(block_number))
+                resp.raise_for_status()
+                meta = resp.json().get("block", {}).get("metadata", {})
+                return meta.get("haiku", "")
+            except Exception as e:
+                print(f"Error fetching block {block_number}: {e}")
+                return ""
+
+    async def generate_image_prompt(self, haiku: str, style_data: dict = None, aspect_ratio: str = "3:4", text_model: str = "gemini-2.0-flash") -> str:
+        prompt_text = build_prompt_request(haiku, style_data, aspect_ratio)
+        async with self.limits["text"]:
+            response = await self.client.aio.models.generate_content(model=text_model, contents=prompt_text)
+        if not response.text: raise RuntimeError("Art Director returned an empty prompt")
+        return response.text.strip()
+
+    async def generate_image_native(self, prompt: str, aspect_ratio: str = "3:4", model_alias: str = "standard", mock: bool = False):
+        if mock: return await self.run_cpu(mock_image, aspect_ratio)
+
+        full_model_name = MODEL_MAP.get(model_alias, MODEL_MAP["standard"])
+        async with self.limits["image"]:
+            try:
+                response = await self.client.aio.models.generate_images(
+                    model=full_model_name, prompt=prompt,
+                    config=types.GenerateImagesConfig(number_of_images=1, aspect_ratio=aspect_ratio)
+                )
+            except Exception as e:
+                error_str = str(e)
+                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                    raise RuntimeError(f"Quota Exceeded for {full_model_name}") from e
+                raise
+        return await self.run_cpu(decode_image, response.generated_images[0].image.image_bytes)
+
+    async def get_design_directives(self, image, haiku: str, text_model: str = "gemini-2.0-flash"):
+        async with self.limits["text"]:
+            try:
+                response = await self.client.aio.models.generate_content(
+                    model=text_model, contents=[design_request(haiku), image],
+                    config=design_config()
+                )
+            except Exception as e:
+                print(f"   [WARN] Design AI failed ({e}), using defaults.")
+                return fallback_design()
+        if response.parsed: return response.parsed
+        print("   [WARN] Design AI returned empty response (likely Safety Filter). Using defaults.")
+        return fallback_design()
+
+    async def render_poster(self, img, haiku: str, block_num: int, design, copy: bool = True):
+        return await self.run_cpu(render_poster, img, haiku, block_num, design, copy)
+
+    async def encode_png(self, img, pnginfo=None) -> bytes:
+        return await self.run_cpu(encode_png, img, pnginfo)
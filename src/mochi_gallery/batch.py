@@ -0,0 +1,304 @@
+import os
+import time
+from PIL import Image
+from .client import fetch_haiku, generate_image_prompt, generate_image_native, get_design_directives, fallback_design
+from .painter import render_poster
+from .render_service import build_pnginfo, render_variants
+from .memory import MemoryBudget, AsyncMemoryBudget, MemoryReport, parse_size, estimate_image_bytes, estimate_target_bytes
+from .storage import write_unique, encode_png, output_dirs, trash_dir_for, store_for, png_size, variant_dir_for, FORMAT_EXTS
+from .gallery_utils import POSTER_NAME_RE
+from . import catalog
+
+# The render pipeline behind 'mochi-gallery render' and 'rerender'. Kept out
+# of cli.py so lightweight commands never import the SDK, PIL or pydantic.
+
+def metadata_fields(haiku, block_num, style_data):
+    fields = {"Haiku": haiku, "Block": str(block_num)}
+    if style_data: fields["Style"] = style_data.get("style_name", "Custom")
+    return fields
+
+def relative_to_output(args, path):
+    return os.path.relpath(path, args.output).replace(os.sep, '/')
+
+def save_variants(args, poster_path, variants):
+    """
+    Writes encoded export targets next to the poster's mirror directory under
+    output/variants/, named <poster stem>_<label>. Returns catalog entries.
+    """
+    stem = os.path.splitext(os.path.basename(poster_path))[0]
+    directory = variant_dir_for(args.output, os.path.dirname(poster_path))
+    if variants: os.makedirs(directory, exist_ok=True)
+    entries = []
+    for target, data in variants:
+        path, _ = write_unique(directory, f"{stem}_{target.label}{FORMAT_EXTS[target.format]}", data, naming=args.naming)
+        with Image.open(path) as im: width, height = im.size
+        entries.append({"label": target.label, "path": relative_to_output(args, path), "width": width,
+                        "height": height, "format": target.format})
+    if entries: print(f"   > [{os.path.basename(poster_path)}] Saved {len(entries)} variants: {', '.join(e['label'] for e in entries)}")
+    return entries
+
+def save_outputs(args, file_prefix, block_num, poster_dir, raw_dir, raw_bytes, poster_bytes, record, raw_path=None, variants=()):
+    """
+    Writes the encoded raw image (if any), poster and variants ([(target,
+    bytes)], see render_variants), then records the render in the catalog.
+    record holds the haiku, style, prompt and models (see render_record).
+    Returns the poster path.
+    """
+    store = store_for(args.output)
+    if raw_bytes is not None:
+        raw_path, _ = write_unique(raw_dir, f"{file_prefix}raw_{block_num}.png", raw_bytes, naming=args.naming, store=store)
+    safe_out_path, created = write_unique(poster_dir, f"{file_prefix}block_{block_num}.png", poster_bytes, naming=args.naming,
+                                          reserved_dirs=[trash_dir_for(args.output, poster_dir)], store=store)
+    if created: print(f"   > [{block_num}] Saved: {safe_out_path}")
+    else: print(f"   > [{block_num}] Identical poster already saved: {safe_out_path}")
+
+    catalog.record_render(
+        args.output, relative_to_output(args, safe_out_path), block_num, record["haiku"], style=record["style"],
+        model=record["model"], text_model=record["text_model"], prompt=record["prompt"],
+        raw_path=relative_to_output(args, raw_path) if raw_path else None, size=png_size(poster_bytes),
+        variants=save_variants(args, safe_out_path, variants),
+    )
+    return safe_out_path
+
+def render_record(args, haiku, style_data, prompt):
+    return {"haiku": haiku, "style": style_data.get("style_name") if style_data else None, "prompt": prompt,
+            "model": args.model, "text_model": args.text_model}
+
+async def run_async_batch(args, client, block_spec, style_data, file_prefix, aspect_ratio, layout, rendered, service=None, report=None):
+    """
+    Drives up to args.concurrency blocks at once from one thread using the
+    asyncio client. Workers pull from the shared (lazy) block iterator.
+    """
+    import asyncio
+    from .async_client import AsyncClient
+
+    blocks = iter(block_spec)
+    state = {"misses": 0, "saved": 0, "stop": False}
+    report = report or MemoryReport()
+    budget = None
+    if args.memory_budget or args.max_inflight_images:
+        budget = AsyncMemoryBudget(parse_size(args.memory_budget) if args.memory_budget else None, args.max_inflight_images)
+
+    async with AsyncClient(client) as ac:
+        async def process(block_num):
+            haiku = await ac.fetch_haiku(block_num)
+            if not haiku or "no haiku" in haiku.lower():
+                print(f"   [SKIP] No haiku found for block {block_num}.")
+                state["misses"] += 1
+                if block_spec.is_open_ended and state["misses"] >= args.max_misses:
+                    print(f"   > {state['misses']} blocks without data; assuming chain tip reached.")
+                    state["stop"] = True
+                return
+            state["misses"] = 0
+
+            if args.mock: prompt = "Mock prompt."
+            else: prompt = await ac.generate_image_prompt(haiku, style_data, aspect_ratio, text_model=args.text_model)
+
+            # Backpressure: no new image is requested until the budget has room
+            cost = estimate_image_bytes(args.model) + estimate_target_bytes(args.targets, aspect_ratio)
+            if budget: await budget.acquire(cost)
+            try:
+                img = await ac.generate_image_native(prompt, aspect_ratio, args.model, mock=args.mock)
+                poster_dir, raw_dir = output_dirs(args.output, block_num, layout)
+                with report.stage("design", cost):
+                    design = await ac.get_design_directives(img, haiku, text_model=args.text_model)
+                fields = metadata_fields(haiku, block_num, style_data)
+
+                if service:
+                    report.begin("render", cost)
+                    worker_rss = 0
+                    try:
+                        raw_bytes, poster_bytes, variants, worker_rss = await asyncio.wrap_future(
+                            service.submit(img, haiku, block_num, design, fields, targets=args.targets))
+                    finally:
+                        report.end("render", cost, worker_rss)
+                    del img
+                else:
+                    with report.stage("render", cost):
+                        metadata = build_pnginfo(fields)
+                        raw_bytes = await ac.encode_png(img, metadata)
+                        variants = await ac.run_cpu(render_variants, img, haiku, block_num, design, args.targets, metadata)
+                        poster = await ac.render_poster(img, haiku, block_num, design, copy=False)
+                        del img
+                        poster_bytes = await ac.encode_png(poster, metadata)
+                        del poster
+            finally:
+                if budget: await budget.release(cost)
+
+            with report.stage("write", len(raw_bytes) + len(poster_bytes) + sum(len(data) for _, data in variants)):
+                await ac.run_cpu(save_outputs, args, file_prefix, block_num, poster_dir, raw_dir, raw_bytes, poster_bytes,
+                                 render_record(args, haiku, style_data, prompt), None, variants)
+            state["saved"] += 1
+
+        async def worker():
+            for block_num in blocks:
+                if state["stop"]: return
+                if block_num in rendered: continue
+                try: await process(block_num)
+                except Exception as e: print(f"   [ERROR] Failed block {block_num}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    print(f"   > {state['saved']} posters saved.")
+
+def finish_render(args, file_prefix, job, budget=None, report=None):
+    future, block_num, poster_dir, raw_dir, cost, record = job
+    report = report or MemoryReport()
+    try:
+        # The render stage opened in run_sync_batch when the job was submitted
+        worker_rss = 0
+        try:
+            raw_bytes, poster_bytes, variants, worker_rss = future.result()
+        finally:
+            report.end("render", cost, worker_rss)
+        with report.stage("write", len(raw_bytes) + len(poster_bytes) + sum(len(data) for _, data in variants)):
+            save_outputs(args, file_prefix, block_num, poster_dir, raw_dir, raw_bytes, poster_bytes, record, variants=variants)
+    except Exception as e:
+        print(f"   [ERROR] Failed rendering block {block_num}: {e}")
+    finally:
+        if budget: budget.release(cost)
+
+def run_sync_batch(args, client, block_spec, style_data, file_prefix, aspect_ratio, layout, rendered, total, service=None, report=None):
+    total_label = total if total is not None else "?"
+    misses = 0
+    report = report or MemoryReport()
+    budget = None
+    if args.memory_budget or args.max_inflight_images:
+        budget = MemoryBudget(parse_size(args.memory_budget) if args.memory_budget else None, args.max_inflight_images)
+    # Renders handed to the process pool, oldest first
+    pending = []
+
+    for index, block_num in enumerate(block_spec):
+        if block_num in rendered:
+            print(f"\n[{index+1}/{total_label}] [SKIP] Block {block_num} already rendered.")
+            continue
+
+        print(f"\n[{index+1}/{total_label}] Processing Block {block_num}...")
+        
+        try:
+            haiku = fetch_haiku(block_num)
+            if not haiku or "no haiku" in haiku.lower():
+                print(f"   [SKIP] No haiku found for block {block_num}.")
+                misses += 1
+                if block_spec.is_open_ended and misses >= args.max_misses:
+                    print(f"   > {misses} consecutive blocks without data; assuming chain tip reached.")
+                    break
+                continue
+            misses = 0
+            
+            # --- RESTORED HAIKU DISPLAY ---
+            print("\n" + "-"*30)
+            print(haiku)
+            print("-"*30 + "\n")
+            # ------------------------------
+
+            if args.mock:
+                prompt = "Mock prompt."
+            else:
+                prompt = generate_image_prompt(client, haiku, style_data, aspect_ratio, text_model=args.text_model)
+                
+            # --- ART DIRECTOR OUTPUT ---
+            print("="*60)
+            print(f"🎨 ART DIRECTOR'S PROMPT ({args.text_model}):")
+            print("-" * 60)
+            print(prompt)
+            print("="*60 + "\n")
+            # ---------------------------
+
+            # Backpressure: finish queued renders until the next image fits the budget
+            cost = estimate_image_bytes(args.model) + estimate_target_bytes(args.targets, aspect_ratio)
+            if budget:
+                while pending and not budget.try_acquire(cost):
+                    finish_render(args, file_prefix, pending.pop(0), budget, report)
+                if not pending: budget.acquire(cost)
+
+            handed_off = False
+            try:
+                img = generate_image_native(client, prompt, aspect_ratio, args.model, mock=args.mock)
+                
+                poster_dir, raw_dir = output_dirs(args.output, block_num, layout)
+                fields = metadata_fields(haiku, block_num, style_data)
+
+                if service:
+                    # Render + encode in a worker process while we fetch the next block
+                    with report.stage("design", cost):
+                        design = get_design_directives(client, img, haiku, text_model=args.text_model)
+                    future = service.submit(img, haiku, block_num, design, fields, targets=args.targets)
+                    report.begin("render", cost)
+                    pending.append((future, block_num, poster_dir, raw_dir, cost, render_record(args, haiku, style_data, prompt)))
+                    handed_off = True
+                    del img
+                    while len(pending) > service.workers * 2:
+                        finish_render(args, file_prefix, pending.pop(0), budget, report)
+                    while pending and pending[0][0].done():
+                        finish_render(args, file_prefix, pending.pop(0), budget, report)
+                else:
+                    # Save Raw
+                    metadata = build_pnginfo(fields)
+                    raw_path, _ = write_unique(raw_dir, f"{file_prefix}raw_{block_num}.png", encode_png(img, metadata), naming=args.naming,
+                                               store=store_for(args.output))
+
+                    # Design & Render (in place: the raw image is already saved)
+                    with report.stage("design", cost):
+                        design = get_design_directives(client, img, haiku, text_model=args.text_model)
+                    with report.stage("render", cost):
+                        variants = render_variants(img, haiku, block_num, design, args.targets, metadata)
+                        poster = render_poster(img, haiku, block_num, design, copy=False)
+                        del img
+                        poster_bytes = encode_png(poster, metadata)
+                        del poster
+                    with report.stage("write", len(poster_bytes) + sum(len(data) for _, data in variants)):
+                        save_outputs(args, file_prefix, block_num, poster_dir, raw_dir, None, poster_bytes,
+                                     render_record(args, haiku, style_data, prompt), raw_path=raw_path, variants=variants)
+            finally:
+                # Queued renders release their share in finish_render
+                if budget and not handed_off: budget.release(cost)
+
+        except Exception as e:
+            print(f"   [ERROR] Failed block {block_num}: {e}")
+            continue
+        
+        if not args.mock and (total is None or index < total - 1): time.sleep(1)
+
+    for job in pending:
+        finish_render(args, file_prefix, job, budget, report)
+
+def rerender_posters(args, client, sources):
+    """
+    Re-composites posters from their saved raw images with fresh design
+    directives, without generating new images. sources are catalog rows
+    (see catalog.get_renders); each raw image is rendered once.
+    """
+    saved, seen = 0, set()
+    for row in sources:
+        if not row["raw_path"] or row["raw_path"] in seen: continue
+        seen.add(row["raw_path"])
+        raw_file = os.path.join(args.output, *row["raw_path"].split('/'))
+        if not os.path.exists(raw_file):
+            print(f"   [WARN] Raw image for block {row['block']} is missing: {row['raw_path']}")
+            continue
+
+        print(f"\n   > Re-rendering block {row['block']} from {row['raw_path']}...")
+        try:
+            with Image.open(raw_file) as raw:
+                img = raw.convert("RGBA")
+            if args.mock: design = fallback_design()
+            else: design = get_design_directives(client, img, row["haiku"], text_model=args.text_model)
+            style_data = {"style_name": row["style"]} if row["style_id"] else None
+            metadata = build_pnginfo(metadata_fields(row["haiku"], row["block"], style_data))
+            variants = render_variants(img, row["haiku"], row["block"], design, args.targets, metadata)
+            poster = render_poster(img, row["haiku"], row["block"], design, copy=False)
+            del img
+            poster_bytes = encode_png(poster, metadata)
+            del poster
+
+            # Same directory and prefix as the poster being replaced
+            poster_path = os.path.join(args.output, *row["path"].split('/'))
+            match = POSTER_NAME_RE.match(os.path.basename(poster_path))
+            record = {"haiku": row["haiku"], "style": style_data and row["style"], "prompt": row["prompt"],
+                      "model": row["model"], "text_model": args.text_model}
+            save_outputs(args, match.group("prefix") if match else "", row["block"], os.path.dirname(poster_path), None,
+                         None, poster_bytes, record, raw_path=raw_file, variants=variants)
+            saved += 1
+        except Exception as e:
+            print(f"   [ERROR] Failed re-rendering block {row['block']}: {e}")
+    return saved
@@ -0,0 +1,158 @@
+import heapq
+import math
+import itertools
+from bisect import bisect_right
+
+class BlockSpec:
+    """
+    Lazy, compact set of block numbers parsed from a CLI spec.
+
+    Grammar (comma separated):
+        880030              single block
+        880000-880010       inclusive range
+        880000-             open-ended range (runs until stopped)
+        800000-880000:100   range with a step
+        !800500, !801-900   exclusions (same syntax, prefixed with '!')
+
+    Only the interval bounds are stored, so a range of millions of blocks
+    costs the same memory as a single block. Iterating yields sorted,
+    de-duplicated block numbers as a generator.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        # Each interval is (start, stop, step); stop is inclusive or None (open-ended)
+        self.include = list(include or [])
+        self.exclude = sorted(exclude or [], key=lambda iv: iv[0])
+        self._exclude_starts = [iv[0] for iv in self.exclude]
+
+    @property
+    def is_open_ended(self):
+        return any(stop is None for _, stop, _ in self.include)
+
+    @property
+    def bounds(self):
+        """Inclusive (lo, hi) around every included block; hi is None if open-ended."""
+        if not self.include: return None
+        hi = None if self.is_open_ended else max(stop for _, stop, _ in self.include)
+        return (min(start for start, _, _ in self.include), hi)
+
+    def __bool__(self):
+        return bool(self.include)
+
+    def __contains__(self, block_num):
+        if self._is_excluded(block_num): return False
+        return any(_interval_contains(iv, block_num) for iv in self.include)
+
+    def __iter__(self):
+        streams = [_interval_iter(iv) for iv in self.include]
+        last = None
+        for block_num in heapq.merge(*streams):
+            if block_num == last: continue
+            last = block_num
+            if self._is_excluded(block_num): continue
+            yield block_num
+
+    def count(self, max_checks=100_000):
+        """
+        Number of blocks in the spec, computed from the interval bounds.
+        Between consecutive bounds the same intervals apply throughout, so
+        membership repeats with the lcm of their steps and one period is
+        enough. Returns None if open-ended, or if the steps are so irregular
+        that this would take more than max_checks membership tests.
+        """
+        if self.is_open_ended: return None
+        intervals = self.include + self.exclude
+        cuts = sorted({start for start, _, _ in intervals} | {stop + 1 for _, stop, _ in intervals if stop is not None})
+        total = checks = 0
+        for lo, hi in zip(cuts, cuts[1:]):
+            # Every interval covers [lo, hi) entirely or not at all
+            inc = [iv for iv in self.include if iv[0] <= lo and iv[1] >= hi - 1]
+            if not inc: continue
+            exc = [iv for iv in self.exclude if iv[0] <= lo and (iv[1] is None or iv[1] >= hi - 1)]
+            if len(inc) == 1 and not exc:
+                start, _, step = inc[0]
+                total += len(range(lo + (start - lo) % step, hi, step))
+                continue
+            period = math.lcm(*(step for _, _, step in inc + exc))
+            checks += 2 * min(period, hi - lo)
+            if checks > max_checks: return None
+            hits = lambda a, b: sum(1 for n in range(a, b) if any(_interval_contains(iv, n) for iv in inc)
+                                    and not any(_interval_contains(iv, n) for iv in exc))
+            periods, rest = divmod(hi - lo, period)
+            if periods: total += periods * hits(lo, lo + period)
+            total += hits(hi - rest, hi)
+        return total
+
+    def _is_excluded(self, block_num):
+        # Exclusions are sorted by start; only those starting at or before
+        # block_num can contain it.
+        idx = bisect_right(self._exclude_starts, block_num)
+        for iv in reversed(self.exclude[:idx]):
+            if _interval_contains(iv, block_num): return True
+        return False
+
+def _interval_iter(interval):
+    start, stop, step = interval
+    if stop is None: return itertools.count(start, step)
+    return iter(range(start, stop + 1, step))
+
+def _interval_contains(interval, block_num):
+    start, stop, step = interval
+    if block_num < start: return False
+    if stop is not None and block_num > stop: return False
+    return (block_num - start) % step == 0
+
+def _parse_interval(part):
+    step = 1
+    if ':' in part:
+        part, step_str = part.split(':', 1)
+        step = int(step_str)
+        if step < 1: raise ValueError(f"Invalid step: {step}")
+
+    if '-' in part:
+        start_str, end_str = part.split('-', 1)
+        start = int(start_str)
+        if not end_str.strip(): return (start, None, step)
+        end = int(end_str)
+        if start > end: start, end = end, start
+        return (start, end, step)
+
+    block_num = int(part)
+    return (block_num, block_num, 1)
+
+def parse_block_spec(block_input, exclude=None):
+    """
+    Parses a block spec string (see BlockSpec) plus an optional separate
+    exclusion spec. Malformed parts are skipped, like the original parser.
+    """
+    include, excluded = [], []
+    specs = [(block_input or "", False), (exclude or "", True)]
+    for spec, force_exclude in specs:
+        for part in spec.split(','):
+            part = part.strip()
+            if not part: continue
+            is_exclusion = force_exclude or part.startswith('!')
+            try:
+                interval = _parse_interval(part.lstrip('!'))
+            except ValueError:
+                print(f"   [WARN] Ignoring invalid block spec '{part}'")
+                continue
+            (excluded if is_exclusion else include).append(interval)
+    return BlockSpec(include, excluded)
+
+def parse_block_bounds(text):
+    """
+    Parses a single 'A-B', 'A-', '-B' or 'N' range into an inclusive
+    (lo, hi) pair for catalog queries; either bound may be None. Returns
+    None for an empty string and raises ValueError if malformed.
+    """
+    text = (text or "").strip()
+    if not text: return None
+    if '-' not in text:
+        block_num = int(text)
+        return (block_num, block_num)
+    lo_str, hi_str = text.split('-', 1)
+    lo = int(lo_str) if lo_str.strip() else None
+    hi = int(hi_str) if hi_str.strip() else None
+    if lo is not None and hi is not None and lo > hi: lo, hi = hi, lo
+    return (lo, hi)
@@ -0,0 +1,91 @@
+import os
+from .storage import safe_relpath, remove_files, purge_file, RESERVED_DIRS
+from . import catalog
+
+OPERATIONS = ("delete", "restore", "purge", "restyle")
+
+class BulkError(Exception):
+    pass
+
+def _gallery_file(output_dir, rel_path):
+    return os.path.join(output_dir, *rel_path.split('/'))
+
+def _trash_file(output_dir, rel_path):
+    return os.path.join(output_dir, "deleted", *rel_path.split('/'))
+
+def clean_paths(paths):
+    """Normalizes client-supplied poster paths; raises BulkError for unsafe ones."""
+    cleaned = []
+    for path in paths:
+        rel_path = safe_relpath(path)
+        if not rel_path or rel_path.split('/')[0] in RESERVED_DIRS:
+            raise BulkError(f"Invalid path: {path}")
+        cleaned.append(rel_path)
+    return cleaned
+
+def _move_all(moves):
+    """
+    Renames every (src, dst) pair, or none: if one fails, the ones already
+    done are moved back before the error is raised.
+    """
+    done = []
+    try:
+        for src, dst in moves:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.exists(dst): raise BulkError(f"Destination already exists: {dst}")
+            os.rename(src, dst)
+            done.append((src, dst))
+    except Exception:
+        for src, dst in reversed(done):
+            try: os.rename(dst, src)
+            except OSError as e: print(f"   [WARN] Could not roll back {dst}: {e}")
+        raise
+
+def apply_bulk(output_dir, op, paths=None, style=None, blocks=None, to_style=None):
+    """
+    Applies one operation to many posters as a single batch:
+
+        delete   live posters -> output/deleted/ (soft delete)
+        restore  soft-deleted posters -> back to their gallery path
+        purge    soft-deleted posters -> removed for good (with their variants
+                 and any raw image no other render uses)
+        restyle  relabel live posters with to_style in the catalog
+
+    Posters are picked by an explicit path list or by style / (lo, hi)
+    block range. File moves are all-or-nothing, and the catalog is updated
+    in one transaction afterwards, so the gallery index changes once.
+
+    Returns {"op", "done", "skipped"}; skipped lists requested paths that
+    are not in the required state (or whose file is missing). Rejected
+    requests raise BulkError.
+    """
+    if op not in OPERATIONS: raise BulkError(f"Unknown operation '{op}'")
+    if op == "restyle" and not to_style: raise BulkError("restyle needs a target style")
+    if paths is not None: paths = clean_paths(paths)
+    elif not style and not blocks: raise BulkError("Select posters by path, style or block range")
+
+    in_trash = op in ("restore", "purge")
+    selected = catalog.select_paths(output_dir, paths, style, blocks, deleted=in_trash)
+    file_for = _trash_file if in_trash else _gallery_file
+    present = [p for p in selected if os.path.exists(file_for(output_dir, p))]
+    skipped = sorted(set(paths if paths is not None else selected) - set(present))
+
+    if op == "delete":
+        _move_all([(_gallery_file(output_dir, p), _trash_file(output_dir, p)) for p in present])
+        catalog.mark_deleted(output_dir, present)
+    elif op == "restore":
+        _move_all([(_trash_file(output_dir, p), _gallery_file(output_dir, p)) for p in present])
+        catalog.mark_deleted(output_dir, present, deleted=False)
+    elif op == "purge":
+        # Cannot be undone, so the catalog drops exactly what was unlinked.
+        # Blob-store links included: gc_blobs frees the bytes afterwards.
+        purged = []
+        try:
+            for p in present:
+                purge_file(_trash_file(output_dir, p))
+                purged.append(p)
+        finally:
+            remove_files(output_dir, catalog.remove_renders(output_dir, purged))
+    elif op == "restyle":
+        catalog.set_style(output_dir, present, to_style)
+    return {"op": op, "done": len(present), "skipped": skipped}
@@ -0,0 +1,436 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+CATALOG_NAME = "catalog.sqlite3"
+
+# Blocks per change-tracking bucket (see bucket_versions)
+BUCKET_SIZE = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+-- Random per catalog, so a rebuilt catalog never reuses old bucket versions
+INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', abs(random() % 1000000000));
+
+CREATE TABLE IF NOT EXISTS blocks (
+    number INTEGER PRIMARY KEY,
+    haiku  TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS styles (
+    id   INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS renders (
+    id         INTEGER PRIMARY KEY,
+    path       TEXT NOT NULL UNIQUE,  -- poster path relative to the output dir ('/' separated)
+    block      INTEGER NOT NULL REFERENCES blocks(number),
+    style_id   INTEGER REFERENCES styles(id),
+    model      TEXT,
+    text_model TEXT,
+    prompt     TEXT,
+    raw_path   TEXT,
+    width      INTEGER,
+    height     INTEGER,
+    created    REAL NOT NULL,
+    deleted    REAL                   -- soft-delete time, NULL while live
+);
+CREATE INDEX IF NOT EXISTS renders_block   ON renders(block);
+CREATE INDEX IF NOT EXISTS renders_style   ON renders(style_id, block);
+CREATE INDEX IF NOT EXISTS renders_model   ON renders(model);
+CREATE INDEX IF NOT EXISTS renders_created ON renders(created);
+CREATE INDEX IF NOT EXISTS renders_live    ON renders(deleted, block);
+
+CREATE TABLE IF NOT EXISTS variants (
+    id        INTEGER PRIMARY KEY,
+    render_id INTEGER NOT NULL REFERENCES renders(id) ON DELETE CASCADE,
+    label     TEXT NOT NULL,
+    path      TEXT NOT NULL UNIQUE,
+    width     INTEGER,
+    height    INTEGER,
+    format    TEXT
+);
+CREATE INDEX IF NOT EXISTS variants_render ON variants(render_id);
+
+-- Any change to the renders bumps the catalog version (used for ETags)
+CREATE TRIGGER IF NOT EXISTS renders_ins AFTER INSERT ON renders BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS renders_upd AFTER UPDATE ON renders BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS renders_del AFTER DELETE ON renders BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+END;
+
+-- Per-bucket change counters, so derived files (the gallery data chunks)
+-- are only rebuilt for the block ranges that changed
+CREATE TABLE IF NOT EXISTS buckets (
+    number  INTEGER PRIMARY KEY,  -- block / BUCKET_SIZE
+    version INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS renders_ins_bucket AFTER INSERT ON renders BEGIN
+    INSERT INTO buckets VALUES (new.block / {bucket}, 1) ON CONFLICT(number) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS renders_upd_bucket AFTER UPDATE ON renders BEGIN
+    INSERT INTO buckets VALUES (old.block / {bucket}, 1) ON CONFLICT(number) DO UPDATE SET version = version + 1;
+    INSERT INTO buckets VALUES (new.block / {bucket}, 1) ON CONFLICT(number) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS renders_del_bucket AFTER DELETE ON renders BEGIN
+    INSERT INTO buckets VALUES (old.block / {bucket}, 1) ON CONFLICT(number) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS blocks_upd_bucket AFTER UPDATE OF haiku ON blocks BEGIN
+    INSERT INTO buckets VALUES (new.number / {bucket}, 1) ON CONFLICT(number) DO UPDATE SET version = version + 1;
+END;
+""".replace("{bucket}", str(BUCKET_SIZE))
+
+# External-content FTS5 index over the haiku text, kept in sync by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS haiku_fts USING fts5(haiku, content='blocks', content_rowid='number');
+CREATE TRIGGER IF NOT EXISTS blocks_ai AFTER INSERT ON blocks BEGIN
+    INSERT INTO haiku_fts (rowid, haiku) VALUES (new.number, new.haiku);
+END;
+CREATE TRIGGER IF NOT EXISTS blocks_ad AFTER DELETE ON blocks BEGIN
+    INSERT INTO haiku_fts (haiku_fts, rowid, haiku) VALUES ('delete', old.number, old.haiku);
+END;
+CREATE TRIGGER IF NOT EXISTS blocks_au AFTER UPDATE ON blocks BEGIN
+    INSERT INTO haiku_fts (haiku_fts, rowid, haiku) VALUES ('delete', old.number, old.haiku);
+    INSERT INTO haiku_fts (rowid, haiku) VALUES (new.number, new.haiku);
+END;
+"""
+
+# Stored in PRAGMA user_version once the schema exists, so a catalog that
+# is deleted or replaced while a process runs gets its schema back
+SCHEMA_VERSION = 1
+
+_init_lock = threading.Lock()
+
+def catalog_path(output_dir):
+    return os.path.join(output_dir, CATALOG_NAME)
+
+def has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'haiku_fts'").fetchone() is not None
+
+def _init_schema(conn):
+    conn.executescript(SCHEMA)
+    try:
+        conn.executescript(FTS_SCHEMA)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: everything else still works
+        print(f"   [WARN] Haiku full-text index unavailable: {e}")
+
+@contextmanager
+def connect(output_dir):
+    """
+    Opens the gallery catalog (creating it on first use) as a transaction:
+    committed on success, rolled back on error. One connection per call
+    keeps it safe to use from Flask threads and worker pools.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = catalog_path(output_dir)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        # Reads the database header only, so it is cheap on every connect
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            with _init_lock:
+                conn.execute("PRAGMA journal_mode = WAL")
+                _init_schema(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _style_id(conn, style):
+    if not style: return None
+    conn.execute("INSERT OR IGNORE INTO styles (name) VALUES (?)", (style,))
+    return conn.execute("SELECT id FROM styles WHERE name = ?", (style,)).fetchone()[0]
+
+def _upsert_block(conn, block, haiku):
+    conn.execute(
+        "INSERT INTO blocks (number, haiku) VALUES (?, ?) "
+        "ON CONFLICT(number) DO UPDATE SET haiku = excluded.haiku WHERE blocks.haiku != excluded.haiku",
+        (block, haiku),
+    )
+
+def add_render(conn, path, block, haiku, style=None, model=None, text_model=None, prompt=None,
+               raw_path=None, size=None, created=None, variants=()):
+    """Records one poster (and its variants) inside the caller's transaction."""
+    _upsert_block(conn, int(block), haiku)
+    width, height = size or (None, None)
+    conn.execute(
+        "INSERT INTO renders (path, block, style_id, model, text_model, prompt, raw_path, width, height, created) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET deleted = NULL, width = excluded.width, height = excluded.height",
+        (path, int(block), _style_id(conn, style), model, text_model, prompt, raw_path, width, height, created or time.time()),
+    )
+    render_id = conn.execute("SELECT id FROM renders WHERE path = ?", (path,)).fetchone()[0]
+    for variant in variants:
+        conn.execute(
+            "INSERT OR REPLACE INTO variants (render_id, label, path, width, height, format) VALUES (?, ?, ?, ?, ?, ?)",
+            (render_id, variant["label"], variant["path"], variant.get("width"), variant.get("height"), variant.get("format")),
+        )
+    return render_id
+
+def record_render(output_dir, path, block, haiku, **fields):
+    """Records a freshly saved poster in its own transaction."""
+    with connect(output_dir) as conn:
+        return add_render(conn, path, block, haiku, **fields)
+
+def mark_deleted(output_dir, paths, deleted=True):
+    """Soft-deletes (or restores, deleted=False) renders by poster path."""
+    with connect(output_dir) as conn:
+        stamp = time.time() if deleted else None
+        conn.executemany("UPDATE renders SET deleted = ? WHERE path = ?", [(stamp, p) for p in paths])
+
+def move_paths(output_dir, moves):
+    """Applies (old_path, new_path) renames, e.g. after a layout migration."""
+    with connect(output_dir) as conn:
+        conn.executemany("UPDATE renders SET path = ? WHERE path = ?", [(new, old) for old, new in moves])
+        conn.executemany("UPDATE renders SET raw_path = ? WHERE raw_path = ?", [(new, old) for old, new in moves])
+        conn.executemany("UPDATE variants SET path = ? WHERE path = ?", [(new, old) for old, new in moves])
+
+def select_paths(output_dir, paths=None, style=None, blocks=None, deleted=False):
+    """
+    Poster paths of live (or, with deleted=True, soft-deleted) renders,
+    either from an explicit path list or by style/block-range filter.
+    """
+    state = ("r.deleted IS NOT NULL" if deleted else "r.deleted IS NULL", [])
+    where, params = _filters(style, blocks, include_deleted=True, extra=[state])
+    sql = f"SELECT r.path FROM renders r LEFT JOIN styles s ON s.id = r.style_id{where}"
+    with connect(output_dir) as conn:
+        if paths is None:
+            return [row[0] for row in conn.execute(sql + " ORDER BY r.block, r.created", params)]
+        found = []
+        paths = list(paths)
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            found += [row[0] for row in conn.execute(f"{sql} AND r.path IN ({marks})", params + chunk)]
+        return found
+
+def remove_renders(output_dir, paths):
+    """
+    Drops renders (and their variants) whose files were purged. Returns the
+    dropped variant paths, plus the raw images no remaining render (live or
+    soft-deleted) uses, so the caller can delete those files too.
+    """
+    files, raw_paths = [], set()
+    with connect(output_dir) as conn:
+        for path in paths:
+            files += [row[0] for row in conn.execute(
+                "SELECT v.path FROM variants v JOIN renders r ON r.id = v.render_id WHERE r.path = ?", (path,))]
+            raw_paths.update(row[0] for row in conn.execute(
+                "SELECT raw_path FROM renders WHERE path = ? AND raw_path IS NOT NULL", (path,)))
+        conn.executemany("DELETE FROM renders WHERE path = ?", [(p,) for p in paths])
+        files += sorted(raw for raw in raw_paths
+                        if conn.execute("SELECT 1 FROM renders WHERE raw_path = ? LIMIT 1", (raw,)).fetchone() is None)
+    return files
+
+def set_style(output_dir, paths, style):
+    """Relabels renders with another style (None for unstyled)."""
+    with connect(output_dir) as conn:
+        style_id = _style_id(conn, style if style != "Custom" else None)
+        conn.executemany("UPDATE renders SET style_id = ? WHERE path = ?", [(style_id, p) for p in paths])
+
+def version(output_dir):
+    with connect(output_dir) as conn:
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+def is_empty(output_dir):
+    with connect(output_dir) as conn:
+        return conn.execute("SELECT 1 FROM renders LIMIT 1").fetchone() is None
+
+ITEM_COLUMNS = """
+    r.id, r.path AS filename, r.block, b.haiku, COALESCE(s.name, 'Custom') AS style,
+    r.model, r.width, r.height, r.created AS timestamp
+"""
+
+def _filters(style=None, blocks=None, include_deleted=False, extra=()):
+    """
+    WHERE clause for the item queries. style is one name or a list of
+    names; blocks is an inclusive (lo, hi) range, either bound may be None.
+    """
+    clauses, params = [], []
+    for clause, values in extra:
+        clauses.append(clause)
+        params += values
+    if not include_deleted: clauses.append("r.deleted IS NULL")
+    if style:
+        names = [style] if isinstance(style, str) else list(style)
+        marks = ", ".join("?" * len(names))
+        # Unstyled renders are listed as 'Custom'
+        clause = f"s.name IN ({marks})"
+        if "Custom" in names: clause = f"({clause} OR r.style_id IS NULL)"
+        clauses.append(clause)
+        params += names
+    if blocks:
+        lo, hi = blocks
+        if lo is not None:
+            clauses.append("r.block >= ?")
+            params.append(lo)
+        if hi is not None:
+            clauses.append("r.block <= ?")
+            params.append(hi)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def query_renders(output_dir, style=None, blocks=None, limit=None, offset=0):
+    """
+    Live renders, newest blocks first, as manifest items. blocks is an
+    inclusive (lo, hi) range; either bound may be None.
+    """
+    where, params = _filters(style, blocks)
+    sql = (f"SELECT {ITEM_COLUMNS} FROM renders r JOIN blocks b ON b.number = r.block "
+           f"LEFT JOIN styles s ON s.id = r.style_id{where} ORDER BY r.block DESC, r.created DESC")
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    with connect(output_dir) as conn:
+        return [dict(row) for row in conn.execute(sql, params)]
+
+def bucket_range(bucket):
+    """Inclusive (lo, hi) block range of a bucket."""
+    return bucket * BUCKET_SIZE, (bucket + 1) * BUCKET_SIZE - 1
+
+def bucket_versions(output_dir):
+    """
+    (epoch, {bucket: version}) for every bucket holding live renders. A
+    bucket's version moves whenever one of its renders or haiku changes;
+    together with the epoch it identifies the bucket's contents.
+    """
+    with connect(output_dir) as conn:
+        epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+        rows = conn.execute(
+            f"SELECT r.block / {BUCKET_SIZE} AS bucket, COALESCE(MAX(v.version), 0) FROM renders r "
+            f"LEFT JOIN buckets v ON v.number = r.block / {BUCKET_SIZE} WHERE r.deleted IS NULL GROUP BY bucket"
+        )
+        return epoch, dict(rows.fetchall())
+
+def count_renders(output_dir, style=None, blocks=None):
+    where, params = _filters(style, blocks)
+    with connect(output_dir) as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM renders r LEFT JOIN styles s ON s.id = r.style_id{where}", params
+        ).fetchone()[0]
+
+def get_renders(output_dir, path=None, block=None, blocks=None, style=None, include_deleted=False):
+    """
+    Full catalog rows (prompt, models, raw image, variants...) for one
+    poster path, one block or a block range, oldest first.
+    """
+    extra = []
+    if path is not None: extra.append(("r.path = ?", [path]))
+    if block is not None: extra.append(("r.block = ?", [int(block)]))
+    where, params = _filters(style, blocks, include_deleted, extra)
+    with connect(output_dir) as conn:
+        rows = [dict(row) for row in conn.execute(
+            "SELECT r.*, b.haiku, COALESCE(s.name, 'Custom') AS style FROM renders r "
+            f"JOIN blocks b ON b.number = r.block LEFT JOIN styles s ON s.id = r.style_id{where} "
+            "ORDER BY r.block, r.created", params
+        )]
+        for row in rows:
+            row["variants"] = [dict(v) for v in conn.execute(
+                "SELECT label, path, width, height, format FROM variants WHERE render_id = ? ORDER BY label", (row["id"],)
+            )]
+    return rows
+
+def rendered_blocks(output_dir, style=None):
+    with connect(output_dir) as conn:
+        if style is None:
+            rows = conn.execute("SELECT DISTINCT block FROM renders WHERE deleted IS NULL AND style_id IS NULL")
+        else:
+            rows = conn.execute(
+                "SELECT DISTINCT r.block FROM renders r JOIN styles s ON s.id = r.style_id "
+                "WHERE r.deleted IS NULL AND s.name = ?", (style,)
+            )
+        return {row[0] for row in rows}
+
+def list_styles(output_dir):
+    """[(style name, live render count)] sorted by name."""
+    with connect(output_dir) as conn:
+        return [tuple(row) for row in conn.execute(
+            "SELECT COALESCE(s.name, 'Custom') AS style, COUNT(*) FROM renders r LEFT JOIN styles s ON s.id = r.style_id "
+            "WHERE r.deleted IS NULL GROUP BY style ORDER BY style"
+        )]
+
+def reindex(output_dir, poster_files):
+    """
+    Reconciles the catalog with the posters on disk: posters missing from
+    the catalog are imported from their PNG metadata, catalog rows whose
+    file is gone are marked deleted. poster_files yields (rel_path, path).
+    Returns (added, removed).
+    """
+    with connect(output_dir) as conn:
+        known = {row[0]: row[1] for row in conn.execute("SELECT path, deleted FROM renders")}
+        on_disk = set()
+        added = 0
+        for rel_path, file_path in poster_files:
+            on_disk.add(rel_path)
+            if rel_path in known and known[rel_path] is None: continue
+            from PIL import Image  # only needed for posters the catalog has never seen
+            try:
+                with Image.open(file_path) as img:
+                    meta = img.text or img.info
+                    size = img.size
+                block = int(meta.get("Block"))
+            except Exception as e:
+                print(f"     [WARN] Could not read {rel_path}: {e}")
+                continue
+            add_render(conn, rel_path, block, meta.get("Haiku", "No Haiku"), style=meta.get("Style"),
+                       size=size, created=os.path.getmtime(file_path))
+            added += 1
+
+        gone = [(time.time(), p) for p, deleted in known.items() if deleted is None and p not in on_disk]
+        conn.executemany("UPDATE renders SET deleted = ? WHERE path = ?", gone)
+    return added, len(gone)
+
+TOKEN_RE = re.compile(r"\w+")
+
+def _match_query(text):
+    """
+    Turns free text into an FTS5 query: every word must match, as a
+    prefix, so 'moon fal' finds 'falling moon'. Quoting each token keeps
+    FTS operators in user input from being interpreted.
+    """
+    return " ".join(f'"{token}"*' for token in TOKEN_RE.findall(text.lower()))
+
+def search(output_dir, text, style=None, blocks=None, limit=50, offset=0):
+    """
+    Live renders whose haiku contains every word of text, best bm25 match
+    first (newest block breaks ties), filtered like query_renders.
+    Returns (items, total). Falls back to LIKE scans without FTS5.
+    """
+    match = _match_query(text or "")
+    if not match:
+        return query_renders(output_dir, style, blocks, limit, offset), count_renders(output_dir, style, blocks)
+
+    joins = "JOIN blocks b ON b.number = r.block LEFT JOIN styles s ON s.id = r.style_id"
+    with connect(output_dir) as conn:
+        if has_fts(conn):
+            source = f"haiku_fts JOIN renders r ON r.block = haiku_fts.rowid {joins}"
+            where, params = _filters(style, blocks, extra=[("haiku_fts MATCH ?", [match])])
+            rank = "bm25(haiku_fts)"
+        else:
+            source = f"renders r {joins}"
+            tokens = TOKEN_RE.findall(text.lower())
+            where, params = _filters(style, blocks, extra=[("b.haiku LIKE ?", [f"%{t}%"]) for t in tokens])
+            rank = "0"
+
+        total = conn.execute(f"SELECT COUNT(*) FROM {source}{where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {ITEM_COLUMNS}, {rank} AS rank FROM {source}{where} "
+            f"ORDER BY rank, r.block DESC, r.created DESC LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+        items = [dict(row) for row in rows]
+    return items, total
@@ -4,11 +4,13 @@ import json
 import sys
 import glob
 import time
-from PIL.PngImagePlugin import PngInfo
-from .client import get_client, fetch_haiku, generate_image_prompt, generate_image_native, get_design_directives
-from .painter import render_poster
-# Import the new Web Gallery tools
-from .gallery_utils import update_gallery_manifest, create_web_viewer
+from .blocks import parse_block_spec, parse_block_bounds
+from .storage import LAYOUTS
+
+# Heavy dependencies (google-genai, PIL, pydantic, the render pipeline) are
+# imported inside the commands that need them, so 'list', 'gallery' and the
+# other bookkeeping commands start without paying for them.
+# benchmarks/startup.py checks this.
 
 def list_available_styles():
     style_dir = os.path.join(os.getcwd(), "assets", "styles")
@@ -76,55 +78,50 @@ def load_mixed_styles(style_arg):
     }
     return final_style_data, "_".join(prefix_parts) + "_"
 
-def parse_block_range(block_input):
-    blocks = []
-    parts = block_input.split(',')
-    for part in parts:
-        if '-' in part:
-            try:
-                start, end = map(int, part.split('-'))
-                if start > end: start, end = end, start
-                if (end - start) > 50: end = start + 50
-                blocks.extend(range(start, end + 1))
-            except ValueError: continue
-        else:
-            try: blocks.append(int(part))
-            except ValueError: continue
-    return sorted(list(set(blocks)))
-
-def get_unique_filepath(directory, filename):
-    base, ext = os.path.splitext(filename)
-    counter = 1
-    full_path = os.path.join(directory, filename)
-    while os.path.exists(full_path):
-        new_filename = f"{base}_{counter}{ext}"
-        full_path = os.path.join(directory, new_filename)
-        counter += 1
-    return full_path
-
-def main():
-    parser = argparse.ArgumentParser(description="Mochimo Gallery Generator")
-    parser.add_argument("blocks", type=str, help="Block number, list (a,b), or range (a-b)")
-    parser.add_argument("--style", type=str, help="Style name(s)", default=None)
-    parser.add_argument("--ar", type=str, help="Override aspect ratio", default=None)
-    parser.add_argument("--model", type=str, choices=['fast', 'standard', 'ultra'], default='standard', help="Google Imagen model")
-    parser.add_argument("--output", type=str, help="Output directory", default="output")
-    parser.add_argument("--mock", action="store_true", help="Skip API calls")
+def parse_block_range(block_input, exclude=None):
+    """
+    Parses a block spec into a lazy BlockSpec (see blocks.py). Iterating it
+    yields sorted, de-duplicated block numbers without materializing the range.
+    """
+    return parse_block_spec(block_input, exclude=exclude)
 
-    known_models = ["gemini-3-pro-preview", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.0-flash-thinking-exp"]
-    parser.add_argument("--text-model", type=str, default="gemini-2.5-flash", help=f"Gemini model ID. Options: {', '.join(known_models)}")
+def cmd_list(args):
+    list_available_styles()
 
-    args = parser.parse_args()
+def load_targets(spec):
+    from .painter import parse_targets
+    try: return parse_targets(spec)
+    except ValueError as e: sys.exit(f"Error: {e}")
 
-    if args.blocks in ["?", "list"] or args.style in ["?", "list"]:
+def cmd_render(args):
+    if args.style in ["?", "list"]:
         list_available_styles()
         return
 
-    block_list = parse_block_range(args.blocks)
-    if not block_list: sys.exit("Error: No valid block numbers found.")
+    from .client import get_client
+    from .batch import run_async_batch, run_sync_batch
+    args.targets = load_targets(args.targets)
+    from .render_service import RenderService
+    from .memory import MemoryReport
+    from . import catalog
+    from .storage import load_config, save_config
+    from .gallery_utils import update_gallery_manifest, rendered_blocks, ensure_catalog
+
+    block_spec = parse_block_range(args.blocks, exclude=args.exclude)
+    if not block_spec: sys.exit("Error: No valid block numbers found.")
 
     os.makedirs(args.output, exist_ok=True)
     os.makedirs(os.path.join(args.output, "raw"), exist_ok=True)
+    gallery_layout = load_config(args.output)["layout"]
+    layout = args.layout or gallery_layout
+    if layout != gallery_layout:
+        # The gallery, web studio and delete button follow .mochi.json, so a
+        # populated gallery has to be converted as a whole
+        ensure_catalog(args.output)
+        if not catalog.is_empty(args.output):
+            sys.exit(f"Error: This gallery uses the '{gallery_layout}' layout. "
+                     f"Convert it first with 'mochi-gallery migrate --layout {layout}'.")
+        save_config(args.output, layout=layout)
 
     style_data, file_prefix = load_mixed_styles(args.style)
     aspect_ratio = "3:4"
@@ -136,62 +133,25 @@ def main():
     try: client = get_client()
     except Exception as e: sys.exit(f"Client Init Error: {e}")
 
-    total = len(block_list)
-    print(f"\n--- Starting Batch Job: {total} Blocks ---")
+    total = block_spec.count()
+    total_label = total if total is not None else "?"
+    print(f"\n--- Starting Batch Job: {total_label} Blocks ---")
 
-    for index, block_num in enumerate(block_list):
-        print(f"\n[{index+1}/{total}] Processing Block {block_num}...")
-        
-        try:
-            haiku = fetch_haiku(block_num)
-            if not haiku or "no haiku" in haiku.lower():
-                print(f"   [SKIP] No haiku found for block {block_num}.")
-                continue
-            
-            # --- RESTORED HAIKU DISPLAY ---
-            print("\n" + "-"*30)
-            print(haiku)
-            print("-"*30 + "\n")
-            # ------------------------------
-
-            if args.mock:
-                prompt = "Mock prompt."
-            else:
-                prompt = generate_image_prompt(client, haiku, style_data, aspect_ratio, text_model=args.text_model)
-                
-            # --- ART DIRECTOR OUTPUT ---
-            print("="*60)
-            print(f"🎨 ART DIRECTOR'S PROMPT ({args.text_model}):")
-            print("-" * 60)
-            print(prompt)
-            print("="*60 + "\n")
-            # ---------------------------
-
-            img = generate_image_native(client, prompt, aspect_ratio, args.model, mock=args.mock)
-            
-            # Save Raw
-            raw_filename = f"{file_prefix}raw_{block_num}.png"
-            safe_raw_path = get_unique_filepath(os.path.join(args.output, "raw"), raw_filename)
-            metadata = PngInfo()
-            metadata.add_text("Haiku", haiku)
-            metadata.add_text("Block", str(block_num))
-            if style_data: metadata.add_text("Style", style_data.get("style_name", "Custom"))
-            img.save(safe_raw_path, pnginfo=metadata)
-
-            # Design & Render
-            design = get_design_directives(client, img, haiku, text_model=args.text_model)
-            poster = render_poster(img, haiku, block_num, design)
-            
-            poster_filename = f"{file_prefix}block_{block_num}.png"
-            safe_out_path = get_unique_filepath(args.output, poster_filename)
-            poster.save(safe_out_path, pnginfo=metadata)
-            print(f"   > Saved: {safe_out_path}")
-
-        except Exception as e:
-            print(f"   [ERROR] Failed block {block_num}: {e}")
-            continue
-        
-        if not args.mock and index < total - 1: time.sleep(1)
+    # One catalog query up front; per-block checks are set lookups
+    rendered = set()
+    if args.skip_existing: rendered = rendered_blocks(args.output, style_data["style_name"] if style_data else None)
+
+    service = RenderService(args.render_workers) if args.render_workers > 0 else None
+    report = MemoryReport()
+    try:
+        if args.concurrency > 1:
+            import asyncio
+            asyncio.run(run_async_batch(args, client, block_spec, style_data, file_prefix, aspect_ratio, layout, rendered, service, report))
+        else:
+            run_sync_batch(args, client, block_spec, style_data, file_prefix, aspect_ratio, layout, rendered, total, service, report)
+    finally:
+        if service: service.shutdown()
+    if args.memory_report: report.print_summary()
 
     print("\n--- Batch Complete ---")
     
@@ -202,5 +162,271 @@ def main():
     except Exception as e:
         print(f"   [WARN] Failed to update web gallery: {e}")
 
+def cmd_rerender(args):
+    from . import catalog
+    from .gallery_utils import ensure_catalog, update_gallery_manifest
+
+    block_spec = parse_block_range(args.blocks, exclude=args.exclude)
+    if not block_spec: sys.exit("Error: No valid block numbers found.")
+
+    style_name = None
+    if args.style:
+        style_data, _ = load_mixed_styles(args.style)
+        if not style_data: sys.exit(f"Error: Style '{args.style}' not found.")
+        style_name = style_data["style_name"]
+
+    ensure_catalog(args.output)
+    sources = [row for row in catalog.get_renders(args.output, blocks=block_spec.bounds, style=style_name)
+               if row["block"] in block_spec]
+    if not any(row["raw_path"] for row in sources):
+        print("   [WARN] No posters with a saved raw image match; nothing to re-render.")
+        return
+
+    from .client import get_client
+    from .batch import rerender_posters
+    args.targets = load_targets(args.targets)
+
+    client = None
+    if not args.mock:
+        try: client = get_client()
+        except Exception as e: sys.exit(f"Client Init Error: {e}")
+
+    saved = rerender_posters(args, client, sources)
+    print(f"\n   > {saved} posters re-rendered.")
+    update_gallery_manifest(args.output)
+
+def cmd_inspect(args):
+    from . import catalog
+    from .storage import safe_relpath
+
+    target = args.target
+    if target.isdigit():
+        rows = catalog.get_renders(args.output, block=int(target), include_deleted=True)
+    else:
+        if os.path.exists(target): target = os.path.relpath(target, args.output)
+        rows = catalog.get_renders(args.output, path=safe_relpath(target.replace(os.sep, '/')), include_deleted=True)
+    if not rows:
+        print(f"No catalog entry for '{args.target}'. Run 'mochi-gallery reindex' if it was added by hand.")
+        return
+
+    for row in rows:
+        status = "deleted " + time.strftime("%Y-%m-%d %H:%M", time.localtime(row["deleted"])) if row["deleted"] else "live"
+        size = f"{row['width']}x{row['height']}" if row["width"] else "?"
+        print(f"\n{row['path']}  (block {row['block']}, {status})")
+        print("-" * 60)
+        print(f"{'Style':<12}: {row['style']}")
+        print(f"{'Model':<12}: {row['model'] or '?'} / {row['text_model'] or '?'}")
+        print(f"{'Size':<12}: {size}")
+        print(f"{'Created':<12}: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['created']))}")
+        print(f"{'Raw image':<12}: {row['raw_path'] or '-'}")
+        for variant in row["variants"]:
+            print(f"{'Variant':<12}: {variant['label']} {variant['width']}x{variant['height']} {variant['path']}")
+        print(f"{'Haiku':<12}:")
+        print(row["haiku"])
+        if row["prompt"]:
+            print(f"{'Prompt':<12}:")
+            print(row["prompt"])
+
+def cmd_gallery(args):
+    from .gallery_utils import update_gallery_manifest
+    update_gallery_manifest(args.output)
+
+def cmd_migrate(args):
+    from . import catalog
+    from .storage import migrate_layout
+    from .gallery_utils import update_gallery_manifest
+
+    print(f"   > Migrating {args.output} to '{args.layout}' layout...")
+    moved = migrate_layout(args.output, args.layout)
+    catalog.move_paths(args.output, moved)
+    print(f"   > Moved {len(moved)} files.")
+    update_gallery_manifest(args.output)
+
+def cmd_dedupe(args):
+    from .storage import import_into_store
+    from .memory import format_size
+
+    print(f"   > Moving {args.output} into the content-addressed blob store...")
+    files, saved = import_into_store(args.output)
+    print(f"   > {files} files stored, {format_size(saved)} of duplicates reclaimed. New outputs will be deduplicated.")
+
+def cmd_reindex(args):
+    from .gallery_utils import sync_catalog, update_gallery_manifest
+
+    print(f"   > Reindexing catalog for {args.output}...")
+    sync_catalog(args.output)
+    update_gallery_manifest(args.output)
+
+def catalog_style_name(name):
+    """Accepts a style's short name (assets/styles/<name>.json) or its catalog name."""
+    if not name: return None
+    path = resolve_style_path(name)
+    if path:
+        try:
+            with open(path, 'r') as f: return json.load(f).get("style_name", name)
+        except Exception: pass
+    return name
+
+def cmd_bulk(args):
+    from . import catalog
+    from .bulk import apply_bulk, BulkError
+    from .gallery_utils import update_gallery_manifest, ensure_catalog
+
+    style = catalog_style_name(args.style)
+    blocks = None
+    if args.blocks:
+        try: blocks = parse_block_bounds(args.blocks)
+        except ValueError: sys.exit(f"Error: Invalid block range '{args.blocks}'.")
+    paths = args.paths or None
+    if not (paths or style or blocks or args.all):
+        sys.exit("Error: Select posters by path, --style or --blocks (or --all).")
+    if args.all and not (paths or style or blocks): blocks = (None, None)
+
+    ensure_catalog(args.output)
+    if args.dry_run:
+        selected = catalog.select_paths(args.output, paths, style, blocks, deleted=args.op in ("restore", "purge"))
+        for path in selected: print(f"   {path}")
+        print(f"   > {len(selected)} posters would be affected by '{args.op}'.")
+        return
+
+    try:
+        result = apply_bulk(args.output, args.op, paths=paths, style=style, blocks=blocks,
+                            to_style=catalog_style_name(args.to_style))
+    except BulkError as e:
+        sys.exit(f"Error: {e}")
+    for path in result["skipped"]: print(f"   [SKIP] {path}")
+    print(f"   > {args.op}: {result['done']} posters, {len(result['skipped'])} skipped.")
+    if result["done"]: update_gallery_manifest(args.output)
+
+def cmd_mosaic(args):
+    from . import catalog
+    from .gallery_utils import ensure_catalog
+    from .storage import MOSAIC_DIR
+
+    blocks = None
+    if args.blocks:
+        try: blocks = parse_block_bounds(args.blocks)
+        except ValueError: sys.exit(f"Error: Invalid block range '{args.blocks}'.")
+
+    ensure_catalog(args.output)
+    # Oldest block first reads naturally on a contact sheet
+    items = catalog.query_renders(args.output, style=catalog_style_name(args.style), blocks=blocks)[::-1]
+    if args.limit: items = items[:args.limit]
+    if not items:
+        print("   [WARN] No posters match; nothing to do.")
+        return
+
+    from .mosaic import build_mosaic
+
+    out_path = args.out or os.path.join(args.output, MOSAIC_DIR, "mosaic.png")
+    print(f"   > Building a mosaic of {len(items)} posters...")
+    build_mosaic(args.output, items, out_path, tile_width=args.tile_width, columns=args.columns, gap=args.gap,
+                 captions=not args.no_captions, workers=args.workers, rows_per_file=args.rows_per_file)
+
+def cmd_gc(args):
+    from .storage import purge_trash, gc_blobs, remove_files
+    from .memory import format_size
+
+    if args.purge_trash:
+        from . import catalog
+        removed = purge_trash(args.output, args.older_than)
+        remove_files(args.output, catalog.remove_renders(args.output, removed))
+        print(f"   > Purged {len(removed)} files from the trash.")
+    freed, freed_bytes = gc_blobs(args.output)
+    print(f"   > Collected {freed} unreferenced blobs ({format_size(freed_bytes)}).")
+
+COMMANDS = {
+    "list": (cmd_list, "List available styles"),
+    "render": (cmd_render, "Generate posters for blocks (default: 'mochi-gallery 880030' means 'render 880030')"),
+    "rerender": (cmd_rerender, "Re-composite existing posters from their raw images (no new image generation)"),
+    "inspect": (cmd_inspect, "Show the catalog entry for a block number or poster path"),
+    "gallery": (cmd_gallery, "Rebuild the web gallery"),
+    "migrate": (cmd_migrate, "Move an existing gallery to another output layout"),
+    "dedupe": (cmd_dedupe, "Move the gallery into the content-addressed blob store"),
+    "bulk": (cmd_bulk, "Delete, restore, purge or restyle many posters at once"),
+    "mosaic": (cmd_mosaic, "Render a contact sheet of many posters"),
+    "reindex": (cmd_reindex, "Reconcile the catalog with the posters on disk"),
+    "gc": (cmd_gc, "Remove unreferenced blobs (and optionally purge the trash)"),
+}
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--output", type=str, help="Output directory", default="output")
+
+    known_models = ["gemini-3-pro-preview", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.0-flash-thinking-exp"]
+    # Options shared by the commands that run the render pipeline
+    pipeline = argparse.ArgumentParser(add_help=False)
+    pipeline.add_argument("--text-model", type=str, default="gemini-2.5-flash", help=f"Gemini model ID. Options: {', '.join(known_models)}")
+    pipeline.add_argument("--naming", type=str, choices=['counter', 'hash'], default='counter', help="Output naming: numbered (_1, _2...) or content hash (dedupes identical outputs)")
+    pipeline.add_argument("--mock", action="store_true", help="Skip API calls")
+    pipeline.add_argument("--targets", type=str, default="", help="Extra export sizes, e.g. 'web:1080:webp,print:3000x4000,social:1080x1080:jpg:85' (label:WIDTH[xHEIGHT][:format[:quality]])")
+
+    parser = argparse.ArgumentParser(description="Mochimo Gallery Generator")
+    sub = parser.add_subparsers(dest="command", metavar="COMMAND")
+    parents = {"render": [common, pipeline], "rerender": [common, pipeline]}
+    parsers = {name: sub.add_parser(name, help=help_text, description=help_text, parents=parents.get(name, [common]))
+               for name, (_, help_text) in COMMANDS.items()}
+
+    blocks_help = "Block number, list (a,b), range (a-b), open range (a-), stepped range (a-b:step), exclusion (!a)"
+    p = parsers["render"]
+    p.add_argument("blocks", type=str, help=blocks_help)
+    p.add_argument("--exclude", type=str, help="Blocks to skip (same syntax as blocks)", default=None)
+    p.add_argument("--skip-existing", action="store_true", help="Skip blocks that already have a poster in this style")
+    p.add_argument("--max-misses", type=int, default=10, help="Stop an open-ended range after this many consecutive blocks without a haiku")
+    p.add_argument("--style", type=str, help="Style name(s)", default=None)
+    p.add_argument("--ar", type=str, help="Override aspect ratio", default=None)
+    p.add_argument("--model", type=str, choices=['fast', 'standard', 'ultra'], default='standard', help="Google Imagen model")
+    p.add_argument("--layout", type=str, choices=list(LAYOUTS), default=None, help="Output layout for a new gallery: flat, block (<block // 1000>/) or date (<YYYY-MM>/); use 'migrate' to change an existing one")
+    p.add_argument("--concurrency", type=int, default=1, help="Blocks to process concurrently (uses the asyncio pipeline when > 1)")
+    p.add_argument("--render-workers", type=int, default=0, help="Render posters in N worker processes (0 = render inline)")
+    p.add_argument("--memory-budget", type=str, default=None, help="Cap on decoded images in flight, e.g. 512M or 1.5G (blocks new image requests when full)")
+    p.add_argument("--max-inflight-images", type=int, default=None, help="Cap on the number of decoded images in flight")
+    p.add_argument("--memory-report", action="store_true", help="Print peak memory per pipeline stage at the end")
+
+    p = parsers["rerender"]
+    p.add_argument("blocks", type=str, help=blocks_help)
+    p.add_argument("--exclude", type=str, help="Blocks to skip (same syntax as blocks)", default=None)
+    p.add_argument("--style", type=str, help="Only re-render posters in this style", default=None)
+
+    parsers["inspect"].add_argument("target", type=str, help="Block number or poster path")
+    parsers["migrate"].add_argument("--layout", type=str, choices=list(LAYOUTS), required=True, help="Target layout: flat, block or date")
+    p = parsers["bulk"]
+    p.add_argument("op", choices=["delete", "restore", "purge", "restyle"], help="Operation (purge only affects deleted posters)")
+    p.add_argument("paths", nargs="*", help="Poster paths relative to the output directory")
+    p.add_argument("--style", type=str, default=None, help="Select posters in this style")
+    p.add_argument("--blocks", type=str, default=None, help="Select posters in a block range (a-b, a- or -b)")
+    p.add_argument("--all", action="store_true", help="Select every poster (in the trash for restore/purge)")
+    p.add_argument("--to-style", type=str, default=None, help="restyle: the new style")
+    p.add_argument("--dry-run", action="store_true", help="List the selected posters without changing anything")
+
+    p = parsers["mosaic"]
+    p.add_argument("--style", type=str, default=None, help="Only posters in this style")
+    p.add_argument("--blocks", type=str, default=None, help="Only posters in a block range (a-b, a- or -b)")
+    p.add_argument("--limit", type=int, default=None, help="At most N posters")
+    p.add_argument("--columns", type=int, default=None, help="Posters per row (default: a roughly square sheet)")
+    p.add_argument("--tile-width", type=int, default=256, help="Width of each poster tile in pixels")
+    p.add_argument("--gap", type=int, default=4, help="Spacing between tiles in pixels")
+    p.add_argument("--no-captions", action="store_true", help="Leave out the block number under each tile")
+    p.add_argument("--workers", type=int, default=None, help="Parallel decode threads (default: CPU count)")
+    p.add_argument("--rows-per-file", type=int, default=None, help="Split the sheet into files of N rows (default: only when very large)")
+    p.add_argument("--out", type=str, default=None, help="Output image (.png, .jpg or .webp; default: <output>/mosaics/mosaic.png)")
+
+    parsers["gc"].add_argument("--purge-trash", action="store_true", help="Permanently delete soft-deleted files first")
+    parsers["gc"].add_argument("--older-than", type=float, default=None, help="With --purge-trash: only files deleted more than N days ago")
+    return parser
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Backward compatible forms: 'mochi-gallery 880030 --style x' and 'mochi-gallery ?'
+    if argv and argv[0] == "?": argv[0] = "list"
+    if argv and argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"): argv.insert(0, "render")
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return
+    COMMANDS[args.command][0](args)
+
 if __name__ == "__main__":
     main()
@@ -26,13 +26,15 @@ def get_client():
         sys.exit(1)
     return genai.Client(api_key=api_key)
 
-def fetch_haiku(block_number: int) -> str:
-    payload = {
+def block_payload(block_number: int) -> dict:
+    return {
         "network_identifier": {"blockchain": "mochimo", "network": "mainnet"},
         "block_identifier": {"index": block_number, "hash": ""},
     }
+
+def fetch_haiku(block_number: int) -> str:
     try:
-        resp = requests.post(MOCHISAN_API_URL, json=payload, timeout=10)
+        resp = requests.post(MOCHISAN_API_URL, json=block_payload(block_number), timeout=10)
         resp.raise_for_status()
         data = resp.json()
         meta = data.get("block", {}).get("metadata", {})
@@ -41,9 +43,8 @@ def fetch_haiku(block_number: int) -> str:
         print(f"Error fetching block data: {e}")
         return ""
 
-# ADDED: text_model parameter
-def generate_image_prompt(client, haiku: str, style_data: dict = None, aspect_ratio: str = "3:4", text_model: str = "gemini-2.0-flash") -> str:
-    print(f"1. Dreaming up the scene (using {text_model})...")
+def build_prompt_request(haiku: str, style_data: dict = None, aspect_ratio: str = "3:4") -> str:
+    """Builds the Art Director request text (shared by the sync and async clients)."""
     style_instruction = "You are a visual art director. Create a SINGLE, detailed text-to-image prompt."
     
     if style_data:
@@ -62,6 +63,12 @@ def generate_image_prompt(client, haiku: str, style_data: dict = None, aspect_ra
         "Rules: NO TEXT in image. Composition is critical (Subject vs Negative Space).\n"
         f"Haiku:\n{haiku}"
     )
+    return prompt_text
+
+# ADDED: text_model parameter
+def generate_image_prompt(client, haiku: str, style_data: dict = None, aspect_ratio: str = "3:4", text_model: str = "gemini-2.0-flash") -> str:
+    print(f"1. Dreaming up the scene (using {text_model})...")
+    prompt_text = build_prompt_request(haiku, style_data, aspect_ratio)
     
     try:
         # CHANGED: Use text_model variable instead of global
@@ -70,17 +77,23 @@ def generate_image_prompt(client, haiku: str, style_data: dict = None, aspect_ra
     except Exception as e:
         sys.exit(f"Error generating prompt: {e}")
 
+def mock_image(aspect_ratio: str = "3:4") -> Image.Image:
+    w, h = 768, 1024
+    if aspect_ratio == "1:1": w, h = 1024, 1024
+    elif aspect_ratio == "16:9": w, h = 1024, 576
+    img = Image.new('RGB', (w, h), color=(50, 50, 60))
+    return img.convert("RGBA")
+
+def decode_image(image_bytes: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+
 def generate_image_native(client, prompt: str, aspect_ratio: str = "3:4", model_alias: str = "standard", mock: bool = False) -> Image.Image:
     # Resolve short name to full ID
     full_model_name = MODEL_MAP.get(model_alias, MODEL_MAP["standard"])
 
     if mock:
         print(f"   [MOCK] Bypassing {full_model_name}...")
-        w, h = 768, 1024
-        if aspect_ratio == "1:1": w, h = 1024, 1024
-        elif aspect_ratio == "16:9": w, h = 1024, 576
-        img = Image.new('RGB', (w, h), color=(50, 50, 60))
-        return img.convert("RGBA")
+        return mock_image(aspect_ratio)
 
     print(f"2. Painting ({aspect_ratio}) using {model_alias}...")
     try:
@@ -88,7 +101,7 @@ def generate_image_native(client, prompt: str, aspect_ratio: str = "3:4", model_
             model=full_model_name, prompt=prompt,
             config=types.GenerateImagesConfig(number_of_images=1, aspect_ratio=aspect_ratio)
         )
-        return Image.open(io.BytesIO(response.generated_images[0].image.image_bytes)).convert("RGBA")
+        return decode_image(response.generated_images[0].image.image_bytes)
     
     except Exception as e:
         error_str = str(e)
@@ -99,11 +112,8 @@ def generate_image_native(client, prompt: str, aspect_ratio: str = "3:4", model_
         else:
             sys.exit(f"Error painting image: {e}")
 
-def get_design_directives(client, image: Image.Image, haiku: str, text_model: str = "gemini-2.0-flash") -> DesignDirectives:
-    print(f"3. Analyzing composition (using {text_model})...")
-    
-    # 1. Define the Fallback Object first (so we can use it in multiple places)
-    fallback = DesignDirectives(
+def fallback_design() -> DesignDirectives:
+    return DesignDirectives(
         composition_analysis="Error or Safety Filter Triggered", 
         text_color_hex="#FFFFFF", 
         shadow_color_hex="#000000", 
@@ -112,16 +122,26 @@ def get_design_directives(client, image: Image.Image, haiku: str, text_model: st
         font_vibe="serif"
     )
 
-    prompt = (
+def design_request(haiku: str) -> str:
+    return (
         "Act as a Senior Graphic Designer. I need to overlay this Haiku on the image:\n"
         f"'{haiku}'\n"
         "Identify visual weight and negative space. Return JSON plan."
     )
+
+def design_config():
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=DesignDirectives)
+
+def get_design_directives(client, image: Image.Image, haiku: str, text_model: str = "gemini-2.0-flash") -> DesignDirectives:
+    print(f"3. Analyzing composition (using {text_model})...")
+    
+    # 1. Define the Fallback Object first (so we can use it in multiple places)
+    fallback = fallback_design()
     
     try:
         response = client.models.generate_content(
-            model=text_model, contents=[prompt, image],
-            config=types.GenerateContentConfig(response_mime_type="application/json", response_schema=DesignDirectives)
+            model=text_model, contents=[design_request(haiku), image],
+            config=design_config()
         )
         
         # FIX: Explicitly check if parsed data exists
@@ -1,66 +1,279 @@
 import os
-import glob
+import re
 import json
-from PIL import Image
+import hashlib
+import functools
+import threading
+from .storage import iter_files, write_atomic, unlink_files, RESERVED_DIRS, GALLERY_DATA_DIR, STATIC_DIR, PURGE_LEDGER
+from . import catalog
+
+# Poster filenames look like "<prefix>block_<num>.png", optionally with a
+# "_<n>" counter (CLI), "_<timestamp>" (web studio) or "_<hash>" suffix.
+POSTER_NAME_RE = re.compile(r"^(?P<prefix>.*?)block_(?P<block>\d+)(?:_[0-9a-f]+)*\.png$")
+
+def iter_poster_files(output_dir):
+    """
+    Yields (relative_path, DirEntry) for every poster, whether the gallery
+    uses the flat layout or sharded subdirectories.
+    """
+    for rel_path, entry in iter_files(output_dir, skip_dirs=RESERVED_DIRS):
+        if POSTER_NAME_RE.match(entry.name):
+            yield rel_path, entry
+
+# gallery-data/ contents: the chunk list the viewer loads first, and the
+# build's own bookkeeping of which chunk files are still referenced
+DATA_INDEX = "index.js"
+DATA_MANIFEST = "manifest.json"
+CHUNK_NAME_RE = re.compile(r"^b\d+-[0-9a-f]+-\d+\.js$")
+
+# Fingerprinted viewer assets in output/static/
+ASSET_NAME_RE = re.compile(r"^[a-z-]+\.[0-9a-f]{10}\.(?:js|css)$")
+STATIC_REF_RE = re.compile(r"static/([a-z-]+\.[0-9a-f]{10}\.(?:js|css))")
+
+_encoder = json.JSONEncoder()
+_build_lock = threading.Lock()
+
+def sync_catalog(output_dir):
+    """Imports posters on disk that the catalog doesn't know about yet."""
+    files = ((rel_path, entry.path) for rel_path, entry in iter_poster_files(output_dir))
+    added, removed = catalog.reindex(output_dir, files)
+    if added or removed: print(f"   > Catalog synced: {added} added, {removed} missing.")
+    return added, removed
+
+def ensure_catalog(output_dir):
+    """One-time import for galleries created before the catalog existed."""
+    if catalog.is_empty(output_dir): sync_catalog(output_dir)
+
+def rendered_blocks(output_dir, style=None):
+    """
+    Set of block numbers with a live poster in the given style (None for
+    unstyled renders), so batch jobs can skip finished blocks with a set
+    lookup instead of probing the filesystem per block.
+    """
+    ensure_catalog(output_dir)
+    return catalog.rendered_blocks(output_dir, style)
+
+def manifest_version(output_dir):
+    """
+    Fingerprint of the gallery contents: the catalog's change counter plus
+    the viewer version. One indexed read, so it can back an HTTP ETag.
+    """
+    return f"{viewer_version()}.{catalog.version(output_dir)}"
+
+def _chunk_name(bucket, epoch, version):
+    return f"b{bucket}-{epoch:x}-{version}.js"
+
+def _stream_chunk(bucket, items):
+    yield f"mochiGalleryChunk({bucket}, "
+    yield from _encoder.iterencode(items)
+    yield ");\n"
+
+def write_gallery_data(output_dir):
+    """
+    Writes gallery-data/: one script per bucket of blocks (see
+    catalog.bucket_versions) plus a small index.js listing them. Chunk names
+    carry the bucket's catalog version, so only buckets that changed since
+    the last build are queried and rewritten. Every file is streamed to a
+    temp file and swapped in atomically. Returns (written, total) chunks.
+    """
+    data_dir = os.path.join(output_dir, GALLERY_DATA_DIR)
+    manifest_path = os.path.join(data_dir, DATA_MANIFEST)
+    try:
+        with open(manifest_path, "r") as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = {}
+
+    epoch, versions = catalog.bucket_versions(output_dir)
+    chunks, written = [], 0
+    for bucket in sorted(versions, reverse=True):
+        name = _chunk_name(bucket, epoch, versions[bucket])
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            items = catalog.query_renders(output_dir, blocks=catalog.bucket_range(bucket))
+            write_atomic(path, _stream_chunk(bucket, items))
+            written += 1
+        chunks.append((bucket, name))
+
+    index = {"version": manifest_version(output_dir), "styles": catalog.list_styles(output_dir), "chunks": chunks}
+    write_atomic(os.path.join(data_dir, DATA_INDEX), ["mochiGalleryIndex(", json.dumps(index), ");\n"])
+
+    # Chunks dropped by the previous build go now; the ones dropped by this
+    # build are kept one more round for pages still loading the old index
+    current = {name for _, name in chunks}
+    unlink_files(data_dir, [name for name in previous.get("retired", []) if name not in current])
+    # Left by builds that purged chunks through the poster ledger
+    unlink_files(data_dir, [PURGE_LEDGER])
+    retired = [name for name in previous.get("chunks", []) if name not in current]
+    write_atomic(manifest_path, [json.dumps({"chunks": sorted(current), "retired": retired})])
+    return written, len(chunks)
 
 def update_gallery_manifest(output_dir):
     """
-    Scans for images, builds the data list, and regenerates the HTML.
+    Brings the web gallery up to date: the viewer shell (only rewritten
+    when the template changes) and the data chunks of changed blocks.
     """
     print(f"   > Updating Web Gallery in {output_dir}...")
-    
-    gallery_items = []
-    
-    # Find all poster images
-    search_path = os.path.join(output_dir, "*block_*.png")
-    files = glob.glob(search_path)
-    
-    for file_path in files:
-        try:
-            filename = os.path.basename(file_path)
-            
-            with Image.open(file_path) as img:
-                meta = img.text or img.info
-                item = {
-                    "filename": filename,
-                    "block": meta.get("Block", "Unknown"),
-                    "haiku": meta.get("Haiku", "No Haiku"),
-                    "style": meta.get("Style", "Custom"),
-                    "timestamp": os.path.getmtime(file_path)
-                }
-                gallery_items.append(item)
-        except Exception as e:
-            print(f"     [WARN] Could not read {filename}: {e}")
-            continue
+    ensure_catalog(output_dir)
+    with _build_lock:
+        html_path = create_web_viewer(output_dir)
+        written, total = write_gallery_data(output_dir)
+    print(f"   > Web Viewer updated: {html_path} ({written} of {total} data chunks rewritten)")
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    return re.sub(r":\s+", ":", css).replace(";}", "}").strip()
+
+def minify_js(js):
+    """
+    Conservative: drops indentation, blank lines and whole-line comments but
+    keeps line breaks, so automatic semicolon insertion is unaffected.
+    """
+    lines = (line.strip() for line in js.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
 
-    # Sort: Newest Blocks First
-    try:
-        gallery_items.sort(key=lambda x: int(x['block']), reverse=True)
-    except:
-        gallery_items.sort(key=lambda x: x['timestamp'], reverse=True)
+def _fingerprint(name, ext, text):
+    return f"{name}.{hashlib.sha256(text.encode('utf-8')).hexdigest()[:10]}{ext}"
 
-    create_web_viewer(output_dir, gallery_items)
+@functools.lru_cache(maxsize=None)
+def viewer_assets():
+    """
+    (shell_html, {static_name: text}), built once per process. Static names
+    carry a hash of their content, so they can be cached forever.
+    """
+    css, js = minify_css(VIEWER_CSS), minify_js(VIEWER_JS)
+    files = {_fingerprint("gallery", ".css", css): css, _fingerprint("gallery", ".js", js): js}
+    css_name, js_name = files
+    shell = (VIEWER_SHELL.replace("__CRITICAL_CSS__", minify_css(CRITICAL_CSS))
+             .replace("__GALLERY_CSS__", css_name).replace("__GALLERY_JS__", js_name))
+    return shell, files
+
+@functools.lru_cache(maxsize=None)
+def viewer_version():
+    """
+    Hash of the viewer shell. The shell names its fingerprinted assets, so
+    any template change invalidates cached pages without a manual bump.
+    """
+    return hashlib.sha256(viewer_assets()[0].encode('utf-8')).hexdigest()[:10]
 
-def create_web_viewer(output_dir, data):
+def create_web_viewer(output_dir):
     """
-    Generates index.html with Masonry, Filtering, Lightbox, and PAGINATION.
+    Writes the viewer (index.html with Filtering, Lightbox, PAGINATION and
+    the virtualized infinite-scroll mode, which pages through /api/gallery
+    and needs the web studio server) unless it is already current. The
+    static assets go first, so a new shell never points at missing files.
+    The posters themselves come from gallery-data/.
     """
-    html_path = os.path.join(output_dir, "index.html")
-    
-    # Serialize data to JSON string
-    json_data = json.dumps(data)
+    shell, files = viewer_assets()
+    static_dir = os.path.join(output_dir, STATIC_DIR)
+    for name, text in files.items():
+        if not os.path.exists(os.path.join(static_dir, name)):
+            write_atomic(os.path.join(static_dir, name), [text])
 
-    html_template = """<!DOCTYPE html>
+    html_path = os.path.join(output_dir, "index.html")
+    try:
+        with open(html_path, "r", encoding="utf-8") as f:
+            previous = f.read()
+    except FileNotFoundError:
+        previous = ""
+    if previous == shell: return html_path
+    write_atomic(html_path, [shell])
+    # Assets of older viewer versions go; the previous shell's are kept one
+    # more round for pages still loading it (like retired data chunks)
+    keep = set(files) | set(STATIC_REF_RE.findall(previous))
+    unlink_files(static_dir, [name for name in os.listdir(static_dir) if ASSET_NAME_RE.match(name) and name not in keep])
+    unlink_files(static_dir, [PURGE_LEDGER])
+    return html_path
+
+VIEWER_SHELL = """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Mochimo Gallery</title>
+    <style>__CRITICAL_CSS__</style>
+    <link rel="stylesheet" href="static/__GALLERY_CSS__" media="print" onload="this.media='all'">
+    <noscript><link rel="stylesheet" href="static/__GALLERY_CSS__"></noscript>
+    <script defer src="static/__GALLERY_JS__"></script>
+    <script defer src="gallery-data/index.js"></script>
+</head>
+<body>
+
+<header>
+    <img src="/assets/img/logo.png" alt="Mochimo Logo" class="logo">
+    <h1>MOCHIMO GALLERY</h1>
+    <div class="subtitle">AI-GENERATED BLOCKCHAIN ARTIFACTS</div>
     
-    <script src="https://unpkg.com/imagesloaded@5/imagesloaded.pkgd.min.js"></script>
-    <script src="https://unpkg.com/masonry-layout@4/dist/masonry.pkgd.min.js"></script>
+    <div id="search-bar">
+        <input id="search-q" type="search" placeholder="SEARCH HAIKU..." oninput="scheduleSearch()">
+        <input id="search-blocks" type="search" placeholder="BLOCKS (800000-880000)" oninput="scheduleSearch()">
+    </div>
 
-    <style>
+    <div id="filters">
+        <button id="btn-all" class="filter-btn active" onclick="toggleFilter('all')">ALL</button>
+    </div>
+</header>
+
+<!-- Pagination Control Bar -->
+<div id="pagination-bar">
+    <div class="page-controls paged">
+        <label for="pageSize" style="color: #666; font-size: 0.8rem;">ITEMS PER PAGE:</label>
+        <select id="pageSize" onchange="changePageSize()">
+            <option value="20">20</option>
+            <option value="50" selected>50</option>
+            <option value="100">100</option>
+            <option value="999999">ALL</option>
+        </select>
+    </div>
+    
+    <div class="page-controls paged">
+        <button id="btn-prev" class="page-btn" onclick="changePage(-1)">PREV</button>
+        <span id="page-info">Page 1 of 1</span>
+        <button id="btn-next" class="page-btn" onclick="changePage(1)">NEXT</button>
+    </div>
+
+    <div class="page-controls">
+        <button id="btn-select" class="page-btn" onclick="toggleSelectMode()">SELECT</button>
+        <button id="btn-view" class="page-btn" onclick="setViewMode(viewMode === 'scroll' ? 'pages' : 'scroll')">INFINITE SCROLL</button>
+    </div>
+</div>
+
+<div class="gallery" id="gallery"></div>
+<div class="scroller" id="scroller"></div>
+<div class="scroll-status" id="scroll-status"></div>
+
+<!-- Multi-select actions (one /api/bulk call for the whole selection) -->
+<div id="select-bar">
+    <span id="select-count">0 SELECTED</span>
+    <button class="page-btn" onclick="selectShown()">SELECT SHOWN</button>
+    <button class="page-btn" onclick="clearSelection()">CLEAR</button>
+    <button id="btn-delete-selected" class="page-btn danger" onclick="deleteSelected()" disabled>DELETE SELECTED</button>
+</div>
+
+<!-- Lightbox -->
+<div id="lightbox" onclick="closeLightbox(event)">
+    <span id="lb-close">&times;</span>
+    <div id="lb-delete" onclick="deleteCurrent(event)" title="Move to Trash">🗑 DELETE</div>
+    
+    <div id="lb-prev" class="lb-nav" onclick="nav(-1); event.stopPropagation();">‹</div>
+    <div id="lb-next" class="lb-nav" onclick="nav(1); event.stopPropagation();">›</div>
+    
+    <img id="lb-img" src="">
+    
+    <div class="lb-meta">
+        <div id="lb-haiku" class="lb-haiku"></div>
+        <div id="lb-info" class="lb-info"></div>
+    </div>
+</div>
+
+</body>
+</html>
+"""
+
+# Above-the-fold styles, inlined into the shell
+CRITICAL_CSS = """
         :root { --bg: #0a0a0a; --card: #141414; --text: #e0e0e0; --accent: #00ff41; --overlay: rgba(0,0,0,0.95); }
         
         body { background: var(--bg); color: var(--text); font-family: 'Courier New', monospace; margin: 0; padding: 20px; overflow-y: scroll; }
@@ -80,6 +293,15 @@ def create_web_viewer(output_dir, data):
         .filter-btn:hover { border-color: var(--accent); color: var(--accent); }
         .filter-btn.active { background: var(--accent); color: #000; border-color: var(--accent); font-weight: bold; }
 
+        /* Search */
+        #search-bar { display: flex; justify-content: center; flex-wrap: wrap; gap: 10px; margin-top: 20px; }
+        #search-bar input {
+            background: #202020; color: var(--text); border: 1px solid #333; padding: 8px 12px; border-radius: 4px;
+            font-family: inherit; font-size: 0.8rem; width: 260px;
+        }
+        #search-bar input:focus { outline: none; border-color: var(--accent); }
+        #search-bar #search-blocks { width: 180px; }
+
         /* Pagination Bar */
         #pagination-bar {
             display: flex; justify-content: space-between; align-items: center;
@@ -94,7 +316,8 @@ def create_web_viewer(output_dir, data):
         .page-btn:hover:not(:disabled) { border-color: var(--accent); }
         #page-info { font-size: 0.9rem; color: #888; }
 
-        .gallery { max-width: 1800px; margin: 0 auto; min-height: 500px; }
+        .gallery { max-width: 1800px; margin: 0 auto; min-height: 500px; position: relative; }
+        .gallery > .card { position: absolute; margin: 0; }
         
         .card { 
             width: 320px; margin-bottom: 20px; background: var(--card); border-radius: 4px; 
@@ -109,6 +332,11 @@ def create_web_viewer(output_dir, data):
         .haiku { font-size: 1.1rem; line-height: 1.4; color: #fff; white-space: pre-wrap; font-style: italic; }
         .tags { display: flex; gap: 10px; font-size: 0.65rem; color: #666; margin-top: 15px; text-transform: uppercase; }
 
+        @keyframes fadeIn { from { opacity: 0; } to { opacity: 1; } }
+"""
+
+# Lightbox, infinite scroll and multi-select styles, loaded without blocking paint
+VIEWER_CSS = """
         #lightbox { 
             position: fixed; inset: 0; background: var(--overlay); z-index: 1000; 
             display: none; justify-content: center; align-items: center; flex-direction: column;
@@ -142,60 +370,30 @@ def create_web_viewer(output_dir, data):
         }
         #lb-delete:hover { color: #ff0055; border-color: #ff0055; background: rgba(255, 0, 85, 0.1); }
 
-        @keyframes fadeIn { from { opacity: 0; } to { opacity: 1; } }
-    </style>
-</head>
-<body>
-
-<header>
-    <img src="/assets/img/logo.png" alt="Mochimo Logo" class="logo">
-    <h1>MOCHIMO GALLERY</h1>
-    <div class="subtitle">AI-GENERATED BLOCKCHAIN ARTIFACTS</div>
-    
-    <div id="filters">
-        <button id="btn-all" class="filter-btn active" onclick="toggleFilter('all')">ALL</button>
-    </div>
-</header>
-
-<!-- Pagination Control Bar -->
-<div id="pagination-bar">
-    <div class="page-controls">
-        <label for="pageSize" style="color: #666; font-size: 0.8rem;">ITEMS PER PAGE:</label>
-        <select id="pageSize" onchange="changePageSize()">
-            <option value="20">20</option>
-            <option value="50" selected>50</option>
-            <option value="100">100</option>
-            <option value="999999">ALL</option>
-        </select>
-    </div>
-    
-    <div class="page-controls">
-        <button id="btn-prev" class="page-btn" onclick="changePage(-1)">PREV</button>
-        <span id="page-info">Page 1 of 1</span>
-        <button id="btn-next" class="page-btn" onclick="changePage(1)">NEXT</button>
-    </div>
-</div>
-
-<div class="gallery" id="gallery"></div>
+        /* Infinite scroll mode: only cards near the viewport are in the DOM */
+        .scroller { position: relative; margin: 0 auto; display: none; }
+        .scroller .card { position: absolute; margin: 0; opacity: 1; animation: none; }
+        .scroller .card img { background: #1b1b1b; object-fit: cover; }
+        .scroller .meta { overflow: hidden; }
+        .scroller .haiku { display: -webkit-box; -webkit-line-clamp: 4; -webkit-box-orient: vertical; overflow: hidden; }
+        .scroll-status { text-align: center; color: #666; font-size: 0.8rem; padding: 20px; }
+
+        /* Multi-select */
+        .card.selected { outline: 3px solid var(--accent); outline-offset: -3px; }
+        #select-bar {
+            position: fixed; left: 50%; bottom: 20px; transform: translateX(-50%); z-index: 500;
+            display: none; align-items: center; gap: 15px; padding: 10px 20px;
+            background: #111; border: 1px solid var(--accent); border-radius: 4px; box-shadow: 0 0 20px rgba(0, 0, 0, 0.8);
+        }
+        #select-bar.active { display: flex; }
+        #select-count { color: var(--accent); font-size: 0.9rem; }
+        .page-btn.danger:hover:not(:disabled) { color: #ff0055; border-color: #ff0055; }
 
-<!-- Lightbox -->
-<div id="lightbox" onclick="closeLightbox(event)">
-    <span id="lb-close">&times;</span>
-    <div id="lb-delete" onclick="deleteCurrent(event)" title="Move to Trash">🗑 DELETE</div>
-    
-    <div id="lb-prev" class="lb-nav" onclick="nav(-1); event.stopPropagation();">‹</div>
-    <div id="lb-next" class="lb-nav" onclick="nav(1); event.stopPropagation();">›</div>
-    
-    <img id="lb-img" src="">
-    
-    <div class="lb-meta">
-        <div id="lb-haiku" class="lb-haiku"></div>
-        <div id="lb-info" class="lb-info"></div>
-    </div>
-</div>
+"""
 
-<script>
-    const DATA = __JSON_DATA__;
+VIEWER_JS = """
+    const DATA = [];
+    let STYLES = [];
     const container = document.getElementById('gallery');
     const filterNav = document.getElementById('filters');
     
@@ -203,33 +401,76 @@ def create_web_viewer(output_dir, data):
     let activeFilters = new Set();
     let filteredData = DATA; // Contains all items matching current filters
     let currentViewData = []; // Contains only items on current page
-    let msnry; 
     
     // Pagination State
     let currentPage = 1;
     let itemsPerPage = 50;
+    let totalItems = DATA.length;
+
+    // Search State (queries run server-side against the catalog index)
+    const SEARCH_MAX_LIMIT = 200;
+    let searchTimer = null;
+    let searchSeq = 0;
+    function searchParams() {
+        return { q: document.getElementById('search-q').value.trim(), blocks: document.getElementById('search-blocks').value.trim() };
+    }
+    function isSearching() {
+        const { q, blocks } = searchParams();
+        return q !== '' || blocks !== '';
+    }
+    function pageSize() {
+        return isSearching() ? Math.min(itemsPerPage, SEARCH_MAX_LIMIT) : itemsPerPage;
+    }
+    function scheduleSearch() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => { currentPage = 1; applyPagination(); }, 250);
+    }
 
-    // 1. Initialize Filters
-    const styles = [...new Set(DATA.map(i => i.style))].sort();
-    styles.forEach(style => {
-        const btn = document.createElement('button');
-        btn.className = 'filter-btn';
-        btn.innerText = style;
-        btn.dataset.style = style;
-        btn.onclick = () => toggleFilter(style);
-        filterNav.appendChild(btn);
-    });
+    // 1. Initialize Filters (style list and counts come from the catalog)
+    function buildFilters() {
+        STYLES.forEach(([style, count]) => {
+            const btn = document.createElement('button');
+            btn.className = 'filter-btn';
+            btn.innerText = `${style} (${count})`;
+            btn.dataset.style = style;
+            btn.onclick = () => toggleFilter(style);
+            filterNav.appendChild(btn);
+        });
+    }
 
     // 2. Pagination Logic
     function applyPagination() {
+        if (viewMode === 'scroll') return vsReset();
+        if (isSearching()) return fetchSearchPage();
         const start = (currentPage - 1) * itemsPerPage;
         const end = start + itemsPerPage;
         currentViewData = filteredData.slice(start, end);
+        totalItems = filteredData.length;
         
         render(currentViewData);
         updatePaginationControls();
     }
 
+    function fetchSearchPage() {
+        const { q, blocks } = searchParams();
+        const params = new URLSearchParams({ q, blocks, limit: pageSize(), offset: (currentPage - 1) * pageSize() });
+        activeFilters.forEach(style => params.append('style', style));
+        const seq = ++searchSeq;
+        return fetch('/api/search?' + params)
+            .then(res => res.ok ? res.json() : res.json().then(body => Promise.reject(body.error)))
+            .then(page => {
+                if (seq !== searchSeq) return; // a newer query is already on its way
+                currentViewData = page.items;
+                totalItems = page.total;
+                render(currentViewData);
+                updatePaginationControls();
+            })
+            .catch(err => {
+                if (seq !== searchSeq) return;
+                container.innerHTML = `<div class="haiku" style="text-align:center">Search failed: ${err || 'server unavailable'}</div>`;
+            });
+    }
+
     function changePageSize() {
         itemsPerPage = parseInt(document.getElementById('pageSize').value);
         currentPage = 1; // Reset to start
@@ -237,7 +478,7 @@ def create_web_viewer(output_dir, data):
     }
 
     function changePage(delta) {
-        const maxPage = Math.ceil(filteredData.length / itemsPerPage);
+        const maxPage = Math.ceil(totalItems / pageSize());
         const newPage = currentPage + delta;
         
         if (newPage >= 1 && newPage <= maxPage) {
@@ -249,35 +490,66 @@ def create_web_viewer(output_dir, data):
     }
 
     function updatePaginationControls() {
-        const maxPage = Math.ceil(filteredData.length / itemsPerPage) || 1;
+        const maxPage = Math.ceil(totalItems / pageSize()) || 1;
         document.getElementById('page-info').innerText = `Page ${currentPage} of ${maxPage}`;
         document.getElementById('btn-prev').disabled = (currentPage === 1);
         document.getElementById('btn-next').disabled = (currentPage === maxPage);
     }
 
-    // 3. Render
+    // 3. Render: each card goes into the shortest column, like Masonry.
+    //    Images carry their catalog size, so card heights are known before
+    //    they load: heights are read once per page, in one pass, and a
+    //    resize only moves the cards.
+    const grid = { heights: [], cols: 0 };
+
+    function gridColumns() {
+        return Math.max(1, Math.floor((container.parentElement.clientWidth - 40 + GUTTER) / (CARD_W + GUTTER)));
+    }
+
+    function layoutGrid() {
+        const cards = container.querySelectorAll('.card');
+        grid.cols = gridColumns();
+        const colHeights = new Array(grid.cols).fill(0);
+        cards.forEach((card, i) => {
+            let col = 0;
+            for (let c = 1; c < grid.cols; c++) if (colHeights[c] < colHeights[col]) col = c;
+            card.style.left = (col * (CARD_W + GUTTER)) + 'px';
+            card.style.top = colHeights[col] + 'px';
+            colHeights[col] += grid.heights[i] + GUTTER;
+        });
+        container.style.width = cards.length ? (grid.cols * (CARD_W + GUTTER) - GUTTER) + 'px' : '';
+        container.style.height = cards.length ? Math.max(...colHeights) + 'px' : '';
+    }
+
     function render(items) {
-        if (msnry) msnry.destroy();
         container.innerHTML = '';
+        const fragment = document.createDocumentFragment();
         items.forEach((item, index) => {
             const card = document.createElement('div');
             card.className = 'card';
             // Important: Lightbox index now refers to currentViewData index
-            card.onclick = () => openLightbox(index);
+            card.onclick = () => cardClick(card, item, index);
+            if (selected.has(item.filename)) card.classList.add('selected');
             
             card.innerHTML = `
-                <img src="/output/${item.filename}" alt="Block ${item.block}">
+                <img src="/output/${item.filename}" alt="Block ${item.block}" ${item.width ? `width="${item.width}" height="${item.height}"` : ''}>
                 <div class="meta">
                     <span class="block-id">BLOCK #${item.block}</span>
                     <div class="haiku">${item.haiku}</div>
                     <div class="tags">${item.style}</div>
                 </div>
             `;
-            container.appendChild(card);
-        });
-        imagesLoaded( container, function() {
-            msnry = new Masonry( container, { itemSelector: '.card', columnWidth: 320, gutter: 20, fitWidth: true });
+            // Posters without a catalog size are re-measured once they load
+            if (!item.width) card.querySelector('img').onload = () => {
+                if (!card.isConnected) return;
+                grid.heights[index] = card.offsetHeight;
+                layoutGrid();
+            };
+            fragment.appendChild(card);
         });
+        container.appendChild(fragment);
+        grid.heights = Array.from(container.querySelectorAll('.card'), card => card.offsetHeight);
+        layoutGrid();
     }
 
     // 4. Filter Logic
@@ -320,14 +592,19 @@ def create_web_viewer(output_dir, data):
         lb.classList.add('active');
     }
 
+    function lightboxItems() {
+        return viewMode === 'scroll' ? vs.items : currentViewData;
+    }
+
     function updateLightbox() {
-        const item = currentViewData[lightboxIndex];
+        const item = lightboxItems()[lightboxIndex];
         lbImg.src = "/output/" + item.filename;
         lbHaiku.innerText = item.haiku;
         lbInfo.innerText = `BLOCK #${item.block} // ${item.style}`;
     }
 
     function nav(dir) {
+        if (viewMode === 'scroll') return vsNav(dir);
         lightboxIndex += dir;
         if (lightboxIndex < 0) lightboxIndex = currentViewData.length - 1;
         if (lightboxIndex >= currentViewData.length) lightboxIndex = 0;
@@ -337,13 +614,13 @@ def create_web_viewer(output_dir, data):
     // Delete Logic
     function deleteCurrent(e) {
         e.stopPropagation();
-        const item = currentViewData[lightboxIndex];
+        const item = lightboxItems()[lightboxIndex];
         if (!confirm(`Are you sure you want to delete block #${item.block}?`)) return;
 
         fetch('/delete', {
             method: 'POST',
             headers: {'Content-Type': 'application/x-www-form-urlencoded'},
-            body: `filename=${item.filename}`
+            body: `filename=${encodeURIComponent(item.filename)}`
         })
         .then(res => {
             if (res.ok) {
@@ -357,7 +634,13 @@ def create_web_viewer(output_dir, data):
 
                 // Close and refresh current page view
                 lb.classList.remove('active');
-                applyPagination();
+                if (viewMode === 'scroll') {
+                    vs.items.splice(lightboxIndex, 1);
+                    vs.total--;
+                    vsRelayout();
+                } else {
+                    applyPagination();
+                }
             } else {
                 alert("Error deleting file.");
             }
@@ -370,8 +653,310 @@ def create_web_viewer(output_dir, data):
         }
     }
 
-    // Initial Load
-    applyPagination();
+    // 6. Infinite Scroll Mode
+    // Cards are absolutely positioned from the catalog's width/height, so
+    // layout never waits for images, and only cards within OVERSCAN pixels
+    // of the viewport exist in the DOM. Pages are fetched as the user
+    // scrolls; the lightbox walks the whole filtered result set.
+    const CARD_W = 320, GUTTER = 20, META_H = 170, PAGE = 200, OVERSCAN = 1000;
+    const scroller = document.getElementById('scroller');
+    const scrollStatus = document.getElementById('scroll-status');
+    const vs = { items: [], total: 0, tops: [], lefts: [], heights: [], colHeights: [0], cols: 1, maxH: 0,
+                 nodes: new Map(), loading: null, seq: 0, frame: 0 };
+    let viewMode = 'pages';
+
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.innerText = text;
+        return div.innerHTML;
+    }
+
+    function imageHeight(item) {
+        // Posters are 3:4 unless the catalog knows better
+        const ratio = (item.width && item.height) ? item.height / item.width : 4 / 3;
+        return Math.round(CARD_W * ratio);
+    }
+
+    function vsPageUrl(offset) {
+        const { q, blocks } = searchParams();
+        const params = new URLSearchParams({ limit: PAGE, offset });
+        if (blocks) params.set('blocks', blocks);
+        activeFilters.forEach(style => params.append('style', style));
+        if (q) {
+            params.set('q', q);
+            return '/api/search?' + params;
+        }
+        return '/api/gallery?' + params;
+    }
+
+    function vsPlace(index) {
+        // Shortest column first, so tops never decrease (see vsRender)
+        let col = 0;
+        for (let c = 1; c < vs.cols; c++) if (vs.colHeights[c] < vs.colHeights[col]) col = c;
+        const height = imageHeight(vs.items[index]) + META_H;
+        vs.tops[index] = vs.colHeights[col];
+        vs.lefts[index] = col * (CARD_W + GUTTER);
+        vs.heights[index] = height;
+        vs.colHeights[col] += height + GUTTER;
+        vs.maxH = Math.max(vs.maxH, height);
+    }
+
+    function vsRelayout() {
+        vs.cols = gridColumns();
+        vs.colHeights = new Array(vs.cols).fill(0);
+        vs.tops = []; vs.lefts = []; vs.heights = []; vs.maxH = 0;
+        scroller.style.width = (vs.cols * (CARD_W + GUTTER) - GUTTER) + 'px';
+        vs.items.forEach((_, i) => vsPlace(i));
+        vs.nodes.forEach(node => node.remove());
+        vs.nodes.clear();
+        vsRender();
+    }
+
+    function vsReset() {
+        vs.seq++;
+        vs.items = [];
+        vs.total = 0;
+        vs.loading = null;
+        vsRelayout();
+        return vsLoadMore().then(vsRender);
+    }
+
+    function vsLoadMore() {
+        if (vs.loading) return vs.loading;
+        if (vs.items.length && vs.items.length >= vs.total) return Promise.resolve();
+        const seq = vs.seq;
+        scrollStatus.innerText = 'LOADING...';
+        vs.loading = fetch(vsPageUrl(vs.items.length))
+            .then(res => res.ok ? res.json() : Promise.reject(res.statusText))
+            .then(page => {
+                if (seq !== vs.seq) return;
+                page.items.forEach(item => vsPlace(vs.items.push(item) - 1));
+                // Rows deleted since the count was taken: stop at what exists
+                vs.total = page.items.length ? page.total : vs.items.length;
+                scrollStatus.innerText = vs.items.length >= vs.total ? `${vs.total} POSTERS` : '';
+            })
+            .catch(err => {
+                if (seq !== vs.seq) return;
+                vs.total = vs.items.length;
+                scrollStatus.innerText = `Infinite scroll needs the gallery server (python3 app.py): ${err}`;
+            })
+            .finally(() => { if (seq === vs.seq) vs.loading = null; });
+        return vs.loading;
+    }
+
+    function vsCard(index) {
+        const item = vs.items[index];
+        const card = document.createElement('div');
+        card.className = 'card';
+        card.style.cssText = `left:${vs.lefts[index]}px; top:${vs.tops[index]}px; width:${CARD_W}px; height:${vs.heights[index]}px;`;
+        card.onclick = () => cardClick(card, item, index);
+        if (selected.has(item.filename)) card.classList.add('selected');
+        card.innerHTML = `
+            <img src="/output/${item.filename}" alt="Block ${item.block}" width="${CARD_W}" height="${imageHeight(item)}"
+                 style="height:${imageHeight(item)}px" loading="lazy" decoding="async">
+            <div class="meta">
+                <span class="block-id">BLOCK #${item.block}</span>
+                <div class="haiku">${escapeHtml(item.haiku)}</div>
+                <div class="tags">${escapeHtml(item.style)}</div>
+            </div>
+        `;
+        return card;
+    }
+
+    function vsRender() {
+        if (viewMode !== 'scroll') return;
+        const offset = -scroller.getBoundingClientRect().top;
+        const viewTop = offset - OVERSCAN, viewBottom = offset + window.innerHeight + OVERSCAN;
+
+        // Tops are non-decreasing, so binary search the first card that can reach viewTop
+        let lo = 0, hi = vs.tops.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (vs.tops[mid] < viewTop - vs.maxH) lo = mid + 1; else hi = mid;
+        }
+        const visible = new Set();
+        for (let i = lo; i < vs.items.length && vs.tops[i] <= viewBottom; i++) {
+            if (vs.tops[i] + vs.heights[i] < viewTop) continue;
+            visible.add(i);
+            if (!vs.nodes.has(i)) {
+                const node = vsCard(i);
+                vs.nodes.set(i, node);
+                scroller.appendChild(node);
+            }
+        }
+        vs.nodes.forEach((node, i) => {
+            if (!visible.has(i)) { node.remove(); vs.nodes.delete(i); }
+        });
+
+        // Reserve room for the rows not fetched yet so the scrollbar reflects the full result set
+        const laidOut = Math.max(...vs.colHeights);
+        const avgRow = vs.items.length ? (laidOut / Math.ceil(vs.items.length / vs.cols)) : 0;
+        scroller.style.height = (laidOut + Math.ceil((vs.total - vs.items.length) / vs.cols) * avgRow) + 'px';
+
+        if (vs.items.length < vs.total && laidOut < viewBottom + OVERSCAN) vsLoadMore().then(vsRender);
+    }
+
+    function vsNav(dir) {
+        const next = lightboxIndex + dir;
+        if (next < 0 || next >= vs.total) return;
+        const show = () => {
+            if (next >= vs.items.length) return;
+            lightboxIndex = next;
+            updateLightbox();
+        };
+        if (next < vs.items.length) show();
+        else vsLoadMore().then(() => { vsRender(); show(); });
+    }
+
+    function setViewMode(mode) {
+        viewMode = mode;
+        try { localStorage.setItem('mochi-gallery-view', mode); } catch (e) {}
+        const scroll = mode === 'scroll';
+        container.style.display = scroll ? 'none' : '';
+        scroller.style.display = scroll ? 'block' : 'none';
+        scrollStatus.style.display = scroll ? '' : 'none';
+        document.querySelectorAll('.page-controls.paged').forEach(el => el.style.visibility = scroll ? 'hidden' : '');
+        document.getElementById('btn-view').innerText = scroll ? 'PAGED VIEW' : 'INFINITE SCROLL';
+        if (scroll) {
+            container.innerHTML = '';
+        } else {
+            vs.seq++;
+            vs.nodes.forEach(node => node.remove());
+            vs.nodes.clear();
+        }
+        currentPage = 1;
+        applyPagination();
+    }
+
+    window.addEventListener('scroll', () => {
+        if (viewMode !== 'scroll' || vs.frame) return;
+        vs.frame = requestAnimationFrame(() => { vs.frame = 0; vsRender(); });
+    }, { passive: true });
+
+    window.addEventListener('resize', () => {
+        const cols = gridColumns();
+        if (viewMode === 'scroll') { if (cols !== vs.cols) vsRelayout(); }
+        else if (cols !== grid.cols) layoutGrid();
+    });
+
+    // 7. Multi-select
+    let selectMode = false;
+    const selected = new Map(); // filename -> item
+    const selectBar = document.getElementById('select-bar');
+
+    function cardClick(card, item, index) {
+        if (!selectMode) return openLightbox(index);
+        if (selected.has(item.filename)) selected.delete(item.filename);
+        else selected.set(item.filename, item);
+        card.classList.toggle('selected', selected.has(item.filename));
+        updateSelectBar();
+    }
+
+    function toggleSelectMode() {
+        selectMode = !selectMode;
+        document.getElementById('btn-select').innerText = selectMode ? 'DONE' : 'SELECT';
+        selectBar.classList.toggle('active', selectMode);
+        if (!selectMode) clearSelection();
+    }
+
+    function updateSelectBar() {
+        document.getElementById('select-count').innerText = `${selected.size} SELECTED`;
+        document.getElementById('btn-delete-selected').disabled = selected.size === 0;
+    }
+
+    function refreshSelectionMarks() {
+        if (viewMode === 'scroll') {
+            vs.nodes.forEach((node, i) => node.classList.toggle('selected', selected.has(vs.items[i].filename)));
+        } else {
+            container.querySelectorAll('.card').forEach((card, i) => card.classList.toggle('selected', selected.has(currentViewData[i].filename)));
+        }
+    }
+
+    function selectShown() {
+        (viewMode === 'scroll' ? vs.items : currentViewData).forEach(item => selected.set(item.filename, item));
+        refreshSelectionMarks();
+        updateSelectBar();
+    }
+
+    function clearSelection() {
+        selected.clear();
+        refreshSelectionMarks();
+        updateSelectBar();
+    }
+
+    function removeWhere(list, gone) {
+        for (let i = list.length - 1; i >= 0; i--) if (gone.has(list[i].filename)) list.splice(i, 1);
+    }
+
+    function deleteSelected() {
+        if (!selected.size || !confirm(`Move ${selected.size} posters to the trash?`)) return;
+        const gone = new Set(selected.keys());
+        fetch('/api/bulk', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ op: 'delete', paths: [...gone] })
+        })
+        .then(res => res.json().then(body => res.ok ? body : Promise.reject(body.error)))
+        .then(() => {
+            removeWhere(DATA, gone);
+            removeWhere(filteredData, gone);
+            clearSelection();
+            if (viewMode === 'scroll') {
+                const before = vs.items.length;
+                removeWhere(vs.items, gone);
+                vs.total -= before - vs.items.length;
+                vsRelayout();
+            } else {
+                applyPagination();
+            }
+        })
+        .catch(err => alert(`Error deleting files: ${err || 'server unavailable'}`));
+    }
+
+    // 8. Data Loading: gallery-data/index.js (loaded by the page right after
+    //    this script) lists the data chunks, newest blocks first, and each
+    //    chunk calls mochiGalleryChunk(). Paths are relative to /gallery/.
+    const chunks = {};
+    let chunkOrder = [];
+    let pendingChunks = 0;
+
+    function dataMissing() {
+        container.innerHTML = '<div class="haiku" style="text-align:center">Gallery data missing: run "mochi-gallery gallery" to rebuild it.</div>';
+    }
+
+    function loadScript(src) {
+        const script = document.createElement('script');
+        script.src = src;
+        script.onerror = dataMissing;
+        document.head.appendChild(script);
+    }
+
+    let indexLoaded = false;
+
+    window.mochiGalleryIndex = (index) => {
+        indexLoaded = true;
+        STYLES = index.styles;
+        chunkOrder = index.chunks.map(([bucket]) => bucket);
+        pendingChunks = chunkOrder.length;
+        if (!pendingChunks) return dataReady();
+        index.chunks.forEach(([bucket, file]) => loadScript(`gallery-data/${file}`));
+    };
+
+    window.mochiGalleryChunk = (bucket, items) => {
+        chunks[bucket] = items;
+        if (--pendingChunks === 0) dataReady();
+    };
+
+    // Initial Load (?view=scroll, or the last mode used)
+    function dataReady() {
+        chunkOrder.forEach(bucket => { for (const item of chunks[bucket]) DATA.push(item); delete chunks[bucket]; });
+        buildFilters();
+        let savedView = null;
+        try { savedView = localStorage.getItem('mochi-gallery-view'); } catch (e) {}
+        setViewMode(new URLSearchParams(location.search).get('view') || savedView || 'pages');
+    }
+    // Deferred scripts have all run by DOMContentLoaded
+    document.addEventListener('DOMContentLoaded', () => { if (!indexLoaded) dataMissing(); });
     
     document.addEventListener('keydown', (e) => {
         if (!lb.classList.contains('active')) return;
@@ -379,15 +964,4 @@ def create_web_viewer(output_dir, data):
         if (e.key === 'ArrowLeft') nav(-1);
         if (e.key === 'ArrowRight') nav(1);
     });
-</script>
-
-</body>
-</html>
-    """
-    
-    # Safe injection
-    final_html = html_template.replace("__JSON_DATA__", json_data)
-    
-    with open(html_path, "w") as f:
-        f.write(final_html)
-    print(f"   > Web Viewer updated: {html_path}")
+"""
@@ -0,0 +1,158 @@
+import re
+import sys
+import asyncio
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Full-canvas RGBA copies alive at once for one block: the decoded image,
+# render_poster's working copy and the PNG encoder's buffers, plus one of
+# headroom for the (text-box sized) glow layers and export targets.
+PIPELINE_COPIES = 4
+
+# Typical Imagen output size per model alias (pixels), before a real decode
+MODEL_PIXELS = {"fast": 1024 * 1024, "standard": 1024 * 1024, "ultra": 2048 * 2048}
+
+def parse_size(text):
+    """Parses '512M', '1.5G', '800k' or a plain byte count."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kmgKMG]?)[bB]?\s*", str(text))
+    if not match: raise ValueError(f"Invalid size: {text}")
+    scale = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[match.group(2).lower()]
+    return int(float(match.group(1)) * scale)
+
+def format_size(nbytes):
+    return f"{nbytes / (1024 ** 2):.1f} MB"
+
+def estimate_image_bytes(model_alias="standard", size=None):
+    """Peak bytes one block needs while its image is decoded and rendered."""
+    pixels = size[0] * size[1] if size else MODEL_PIXELS.get(model_alias, MODEL_PIXELS["standard"])
+    return pixels * 4 * PIPELINE_COPIES
+
+def estimate_target_bytes(targets, aspect_ratio="3:4"):
+    """
+    RGBA bytes of a block's export targets (see painter.Target), rendered on
+    top of the raw image. Targets without a height take the aspect ratio
+    ("W:H") the image was requested in.
+    """
+    try: w, h = (float(x) for x in aspect_ratio.split(":"))
+    except ValueError: w, h = 3, 4
+    return sum(t.width * (t.height or max(1, round(t.width * h / w))) * 4 for t in targets)
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (0 if unavailable)."""
+    if resource is None: return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class _BudgetBase:
+    def __init__(self, limit_bytes=None, max_images=None):
+        self.limit_bytes = limit_bytes
+        self.max_images = max_images
+        self.used_bytes = 0
+        self.images = 0
+
+    def _fits(self, nbytes):
+        if self.max_images and self.images >= self.max_images: return False
+        # Always admit one image, even if it alone exceeds the budget
+        if self.limit_bytes and self.images and self.used_bytes + nbytes > self.limit_bytes: return False
+        return True
+
+    def _take(self, nbytes):
+        self.used_bytes += nbytes
+        self.images += 1
+
+    def _give(self, nbytes):
+        self.used_bytes -= nbytes
+        self.images -= 1
+
+class MemoryBudget(_BudgetBase):
+    """
+    Caps decoded images in flight (by count and/or estimated bytes).
+    acquire() blocks until there is room, which back-pressures the network
+    stage whenever rendering falls behind.
+    """
+
+    def __init__(self, limit_bytes=None, max_images=None):
+        super().__init__(limit_bytes, max_images)
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._cond:
+            self._cond.wait_for(lambda: self._fits(nbytes))
+            self._take(nbytes)
+        return nbytes
+
+    def try_acquire(self, nbytes):
+        with self._cond:
+            if not self._fits(nbytes): return False
+            self._take(nbytes)
+        return True
+
+    def release(self, nbytes):
+        with self._cond:
+            self._give(nbytes)
+            self._cond.notify_all()
+
+class AsyncMemoryBudget(_BudgetBase):
+    """MemoryBudget for the asyncio pipeline (waits without blocking the loop)."""
+
+    def __init__(self, limit_bytes=None, max_images=None):
+        super().__init__(limit_bytes, max_images)
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, nbytes):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._fits(nbytes))
+            self._take(nbytes)
+        return nbytes
+
+    async def release(self, nbytes):
+        async with self._cond:
+            self._give(nbytes)
+            self._cond.notify_all()
+
+class MemoryReport:
+    """
+    Tracks the peak image bytes held by each pipeline stage and the peak RSS
+    of the process that ran it. ru_maxrss is a lifetime high-water mark, so
+    the RSS column is the process peak as of the stage's last completion;
+    stages run in render workers report the worker's peak, not the parent's.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = {}
+        self.peak = {}
+        self.rss = {}
+
+    def begin(self, name, nbytes):
+        with self._lock:
+            self.current[name] = self.current.get(name, 0) + nbytes
+            self.peak[name] = max(self.peak.get(name, 0), self.current[name])
+
+    def end(self, name, nbytes, rss=None):
+        """Closes a begin(); rss is the peak of the process that did the work (default: this one)."""
+        with self._lock:
+            self.current[name] -= nbytes
+            self.rss[name] = max(self.rss.get(name, 0), peak_rss() if rss is None else rss)
+
+    @contextmanager
+    def stage(self, name, nbytes):
+        self.begin(name, nbytes)
+        try:
+            yield
+        finally:
+            self.end(name, nbytes)
+
+    def print_summary(self):
+        if not self.peak: return
+        print(f"\n{'STAGE':<12} | {'PEAK IMAGES':>12} | {'PROCESS PEAK RSS':>16}")
+        print("-" * 46)
+        for name in self.peak:
+            print(f"{name:<12} | {format_size(self.peak[name]):>12} | {format_size(self.rss.get(name, 0)):>16}")
+        print("-" * 46)
@@ -0,0 +1,140 @@
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from .painter import get_font_paths, load_font
+
+# Above this many pixels per output file (~190 MB of RGB) the sheet is
+# split into row bands
+MAX_SHEET_PIXELS = 64_000_000
+
+# Posters are 3:4 unless the catalog says otherwise
+DEFAULT_RATIO = 4 / 3
+
+def caption_font_spec(size):
+    """(path, size) of a sans font from the painter's registry, used for every caption."""
+    paths = get_font_paths()
+    path = next((p for p in paths if "sans" in os.path.basename(p).lower()), paths[0] if paths else None)
+    return path, size
+
+def _load_caption_font(font_spec):
+    path, size = font_spec
+    try:
+        if path: return load_font(path, size)
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except Exception:
+        return ImageFont.load_default()
+
+def load_thumbnail(path, size):
+    """
+    Decodes path straight down to fit inside size: draft() lets JPEG/WebP
+    variants decode at reduced scale, reduce() shrinks by an integer factor
+    cheaply, and only the final step resamples properly.
+    """
+    with Image.open(path) as im:
+        im.draft("RGB", size)
+        factor = max(1, min(im.width // size[0], im.height // size[1]))
+        small = im.reduce(factor) if factor > 1 else im.copy()
+    small = small.convert("RGB")
+    small.thumbnail(size, Image.LANCZOS)
+    return small
+
+class MosaicLayout:
+    """Cell geometry of a contact sheet; cells are tile + caption strip."""
+
+    def __init__(self, count, tile_width=256, ratio=DEFAULT_RATIO, columns=None, gap=4, captions=True):
+        self.tile_w = tile_width
+        self.tile_h = round(tile_width * ratio)
+        self.caption_h = max(12, tile_width // 8) if captions else 0
+        self.cell_h = self.tile_h + self.caption_h
+        self.gap = gap
+        # Roughly square sheet by default
+        self.columns = columns or max(1, math.ceil(math.sqrt(count * self.cell_h / self.tile_w)))
+        self.rows = max(1, math.ceil(count / self.columns))
+        self.width = self.columns * (self.tile_w + gap) + gap
+
+    def band_height(self, rows):
+        return rows * (self.cell_h + self.gap) + self.gap
+
+    def rows_per_file(self, requested=None):
+        if requested: return max(1, requested)
+        return max(1, min(self.rows, MAX_SHEET_PIXELS // (self.width * (self.cell_h + self.gap))))
+
+def _draw_cell(canvas, layout, x, y, path, label, font_spec, background):
+    """Worker: decodes one poster and writes its cell into the band canvas."""
+    try:
+        thumb = load_thumbnail(path, (layout.tile_w, layout.tile_h))
+    except Exception as e:
+        print(f"   [WARN] Could not read {path}: {e}")
+        return False
+
+    cell = Image.new("RGB", (layout.tile_w, layout.cell_h), background)
+    cell.paste(thumb, ((layout.tile_w - thumb.width) // 2, (layout.tile_h - thumb.height) // 2))
+    del thumb
+    if layout.caption_h:
+        font = _load_caption_font(font_spec)
+        draw = ImageDraw.Draw(cell)
+        box = draw.textbbox((0, 0), label, font=font)
+        tx = (layout.tile_w - (box[2] - box[0])) // 2
+        ty = layout.tile_h + (layout.caption_h - (box[3] - box[1])) // 2 - box[1]
+        draw.text((tx, ty), label, font=font, fill=(200, 200, 200))
+    # Cells never overlap, so workers can write into the shared canvas directly
+    canvas[y:y + layout.cell_h, x:x + layout.tile_w] = np.asarray(cell)
+    return True
+
+def band_paths(out_path, bands):
+    if bands == 1: return [out_path]
+    base, ext = os.path.splitext(out_path)
+    return [f"{base}_{i + 1:03d}{ext}" for i in range(bands)]
+
+def build_mosaic(output_dir, items, out_path, tile_width=256, columns=None, gap=4, captions=True,
+                 workers=None, rows_per_file=None, background=(10, 10, 10)):
+    """
+    Renders catalog items (see catalog.query_renders) into a contact sheet.
+
+    Posters are streamed: each band of rows is a preallocated NumPy canvas
+    that worker threads decode into, one poster at a time, so only the band
+    and a few full-size images are ever in memory. Grids too large for one
+    file are split into numbered row bands (out_001.png, out_002.png, ...).
+    Returns the written paths.
+    """
+    if not items: return []
+    ratios = sorted(i["height"] / i["width"] for i in items if i.get("width") and i.get("height"))
+    ratio = ratios[len(ratios) // 2] if ratios else DEFAULT_RATIO
+    layout = MosaicLayout(len(items), tile_width, ratio, columns, gap, captions)
+    per_file = layout.rows_per_file(rows_per_file)
+    bands = math.ceil(layout.rows / per_file)
+    font_spec = caption_font_spec(int(layout.caption_h * 0.6)) if captions else None
+    paths = band_paths(out_path, bands)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+
+    per_band = per_file * layout.columns
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for band, band_path in enumerate(paths):
+            band_items = items[band * per_band:(band + 1) * per_band]
+            rows = math.ceil(len(band_items) / layout.columns)
+            canvas = np.empty((layout.band_height(rows), layout.width, 3), dtype=np.uint8)
+            canvas[:] = background
+
+            jobs = []
+            for index, item in enumerate(band_items):
+                row, col = divmod(index, layout.columns)
+                x = layout.gap + col * (layout.tile_w + layout.gap)
+                y = layout.gap + row * (layout.cell_h + layout.gap)
+                path = os.path.join(output_dir, *item["filename"].split('/'))
+                jobs.append(pool.submit(_draw_cell, canvas, layout, x, y, path, f"#{item['block']}", font_spec, background))
+            drawn = sum(1 for job in jobs if job.result())
+
+            # Replace rather than rewrite: an old sheet may be hard-linked elsewhere
+            stem, ext = os.path.splitext(band_path)
+            tmp_path = f"{stem}.{os.getpid()}.tmp{ext}"
+            try:
+                Image.fromarray(canvas).save(tmp_path)
+                os.replace(tmp_path, band_path)
+            except BaseException:
+                if os.path.exists(tmp_path): os.unlink(tmp_path)
+                raise
+            del canvas
+            print(f"   > Saved {band_path} ({drawn} posters, {layout.width}x{layout.band_height(rows)})")
+    return paths
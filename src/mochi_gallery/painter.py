@@ -1,30 +1,61 @@
 import os
+import io
+import re
 import random
 import glob
+import threading
+from typing import NamedTuple, Optional
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 
+# --- FONT REGISTRY ---
+# Font files are read once per process and parsed fonts are cached per size,
+# instead of globbing and re-parsing the .ttf for every line of every poster.
+# FreeType faces are not thread-safe, so parsed fonts are cached per thread.
+_font_paths = {}
+_font_bytes = {}
+_font_local = threading.local()
+
 def get_font_paths():
     # Look in the local directory first (development mode)
     local_fonts = os.path.join(os.getcwd(), "assets", "fonts")
-    if os.path.exists(local_fonts):
-        return glob.glob(os.path.join(local_fonts, "*.ttf"))
-    return []
+    if local_fonts not in _font_paths:
+        _font_paths[local_fonts] = sorted(glob.glob(os.path.join(local_fonts, "*.ttf"))) if os.path.exists(local_fonts) else []
+    return _font_paths[local_fonts]
 
-def get_font_by_vibe(vibe: str, size: int):
+def load_font(path: str, size: int):
+    cache = getattr(_font_local, "fonts", None)
+    if cache is None: cache = _font_local.fonts = {}
+    if (path, size) not in cache:
+        if path not in _font_bytes:
+            with open(path, 'rb') as f:
+                _font_bytes[path] = f.read()
+        cache[(path, size)] = ImageFont.truetype(io.BytesIO(_font_bytes[path]), size)
+    return cache[(path, size)]
+
+def warm_fonts():
+    """Loads every font file into memory up front (used by render workers)."""
+    for path in get_font_paths():
+        try: load_font(path, 12)
+        except Exception as e: print(f"   [WARN] Could not load font {path}: {e}")
+
+def pick_font(vibe: str):
+    """Path of a font matching vibe (a random one if none does), or None if no fonts are installed."""
     font_files = get_font_paths()
-    selected_font = None
-    if font_files:
-        for f in font_files:
-            if vibe in f.lower():
-                selected_font = f
-                break
-        if not selected_font: selected_font = random.choice(font_files)
+    if not font_files: return None
+    for f in font_files:
+        if vibe in f.lower(): return f
+    return random.choice(font_files)
 
+def font_for(path, size: int):
     try:
-        if selected_font: return ImageFont.truetype(selected_font, size)
+        if path: return load_font(path, size)
         else: return ImageFont.truetype("DejaVuSerif.ttf", size)
     except: return ImageFont.load_default()
 
+def get_font_by_vibe(vibe: str, size: int):
+    return font_for(pick_font(vibe), size)
+
 def hex_to_rgb(hex_color: str):
     return tuple(int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
 
@@ -33,34 +64,48 @@ def get_luminance(rgb_tuple):
     r, g, b = rgb_tuple
     return (0.299 * r + 0.587 * g + 0.114 * b)
 
-def draw_text_with_glow(base_img, x, y, text, font, text_color, glow_color, glow_strength):
+def _composite_glow(base_img, x, y, text, font, offsets, fill, radius):
+    """
+    Draws the offset copies of the text on a transparent layer the size of
+    the padded text box, blurs it and composites it back. Outside that box
+    a full-canvas layer would be fully transparent, so the result matches
+    blurring the whole canvas at a fraction of the memory.
+    """
+    pad = int(radius * 4) + 4
+    left, top, right, bottom = ImageDraw.Draw(base_img).textbbox((x, y), text, font=font)
+    box = (max(0, left - pad), max(0, top - pad), min(base_img.width, right + pad), min(base_img.height, bottom + pad))
+    if box[0] >= box[2] or box[1] >= box[3]: return
+
+    layer = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    for ox, oy in offsets:
+        draw.text((x - box[0] + ox, y - box[1] + oy), text, font=font, fill=fill)
+    glow = layer.filter(ImageFilter.GaussianBlur(radius=radius))
+    base_img.alpha_composite(glow, dest=box[:2])
+
+def _scaled_offsets(steps, scale):
+    return sorted({round(step * scale) for step in steps})
+
+def draw_text_with_glow(base_img, x, y, text, font, text_color, glow_color, glow_strength, scale=1.0):
     """
     Draws text with:
     1. A wide soft glow (atmosphere)
     2. A tight shadow (definition)
     3. A 1px hard stroke (readability guarantee)
+    Glow offsets, radii and stroke are multiplied by scale, so a poster
+    rendered at another size keeps the same look.
     """
 
     # 1. Wide Ambient Glow (Softens the background area)
     # Increased strength from 0.5 to 0.7 for busy backgrounds
-    wide_glow = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
-    draw_wide = ImageDraw.Draw(wide_glow)
-    for ox in range(-2, 3):
-        for oy in range(-2, 3):
-            draw_wide.text((x+ox, y+oy), text, font=font, fill=glow_color + (int(glow_strength * 0.7),))
-    wide_glow = wide_glow.filter(ImageFilter.GaussianBlur(radius=8))
+    wide_steps = _scaled_offsets(range(-2, 3), scale)
+    wide_offsets = [(ox, oy) for ox in wide_steps for oy in wide_steps]
+    _composite_glow(base_img, x, y, text, font, wide_offsets, glow_color + (int(glow_strength * 0.7),), radius=8 * scale)
 
     # 2. Tight Definition Shadow
-    tight_glow = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
-    draw_tight = ImageDraw.Draw(tight_glow)
-    for ox in [-1, 1]:
-        for oy in [-1, 1]:
-            draw_tight.text((x+ox, y+oy), text, font=font, fill=glow_color + (glow_strength,))
-    tight_glow = tight_glow.filter(ImageFilter.GaussianBlur(radius=2))
-
-    # Composite Glows
-    base_img.alpha_composite(wide_glow)
-    base_img.alpha_composite(tight_glow)
+    tight_steps = _scaled_offsets([-1, 1], scale)
+    tight_offsets = [(ox, oy) for ox in tight_steps for oy in tight_steps]
+    _composite_glow(base_img, x, y, text, font, tight_offsets, glow_color + (glow_strength,), radius=2 * scale)
 
     # 3. Determine Smart Stroke Color
     # If text is dark (<128), stroke is white. If text is light, stroke is black.
@@ -82,55 +127,198 @@ def draw_text_with_glow(base_img, x, y, text, font, text_color, glow_color, glow
         text, 
         font=font, 
         fill=text_color + (255,), 
-        stroke_width=1, 
+        stroke_width=max(1, round(scale)), 
         stroke_fill=stroke_rgb + (255,) # Fully opaque stroke
     )
 
     return base_img
 
-def render_poster(img: Image.Image, haiku: str, block_num: int, design) -> Image.Image:
-    print("4. Applying holistic render...")
-    img = img.copy()
-    w, h = img.size
+class Target(NamedTuple):
+    """One export size. height=None keeps the raw image's aspect ratio."""
+    label: str
+    width: int
+    height: Optional[int] = None
+    format: str = "png"
+    quality: int = 90
 
-    ref_dim = min(w, h)
-    base_size = int(ref_dim * 0.045)
+FORMAT_ALIASES = {"png": "png", "jpg": "jpeg", "jpeg": "jpeg", "webp": "webp"}
 
-    font_main = get_font_by_vibe(design.font_vibe, base_size)
-    font_footer = get_font_by_vibe("sans", int(base_size * 0.6))
+def parse_targets(spec: str):
+    """
+    Parses 'label:WIDTH[xHEIGHT][:format[:quality]]' items, comma separated:
+        web:1080:webp,print:3000x4000,social:1080x1080:jpg:85
 
-    lines = [l.strip() for l in haiku.split('\n') if l.strip()]
-    if not lines: lines = ["No Haiku"]
+    Labels are case-insensitive (they name files under variants/). Sizes
+    and quality are checked here, before any image is paid for.
+    """
+    targets = []
+    for part in (spec or "").split(','):
+        part = part.strip()
+        if not part: continue
+        fields = part.split(':')
+        if len(fields) < 2 or len(fields) > 4:
+            raise ValueError(f"Invalid target '{part}' (expected label:WIDTH[xHEIGHT][:format[:quality]])")
+        label = fields[0].lower()
+        if not re.fullmatch(r"[a-z0-9-]+", label):
+            raise ValueError(f"Invalid label in target '{part}' (use letters, digits and '-')")
+        size = re.fullmatch(r"(\d+)(?:x(\d+))?", fields[1].lower())
+        if not size or int(size.group(1)) < 1 or (size.group(2) is not None and int(size.group(2)) < 1):
+            raise ValueError(f"Invalid size in target '{part}' (expected WIDTH or WIDTHxHEIGHT, both at least 1)")
+        fmt = FORMAT_ALIASES.get(fields[2].lower() if len(fields) > 2 else "png")
+        if fmt is None: raise ValueError(f"Unknown format in target '{part}'")
+        quality = fields[3] if len(fields) > 3 else "90"
+        if not quality.isdigit() or not 1 <= int(quality) <= 100:
+            raise ValueError(f"Invalid quality in target '{part}' (expected 1-100)")
+        targets.append(Target(label, int(size.group(1)), int(size.group(2)) if size.group(2) else None, fmt, int(quality)))
+    return targets
 
-    line_h = int(base_size * 1.4)
-    total_h = len(lines) * line_h
-    center_y = int(h * (design.y_position_percent / 100))
+def target_size(target: Target, src_size):
+    if target.height: return (target.width, target.height)
+    w, h = src_size
+    return (target.width, max(1, round(target.width * h / w)))
+
+def crop_box(src_size, size):
+    """
+    Centred (left, top, right, bottom) region of src_size with the aspect
+    ratio of size: the whole image unless the aspects differ.
+    """
+    w, h = src_size
+    tw, th = size
+    if abs(tw / th - w / h) < 0.01: return (0, 0, w, h)
+    if tw / th > w / h:
+        crop_h = w * th / tw
+        top = (h - crop_h) / 2
+        return (0, top, w, top + crop_h)
+    crop_w = h * tw / th
+    left = (w - crop_w) / 2
+    return (left, 0, left + crop_w, h)
+
+def resample_for(img: Image.Image, size, box=None) -> Image.Image:
+    """The raw image's box region (default: all of it) resampled to size."""
+    box = box or (0, 0) + img.size
+    if size == img.size and box == (0, 0) + img.size: return img.copy()
+    return img.resize(size, Image.LANCZOS, box=box, reducing_gap=3.0)
+
+class PosterLayout(NamedTuple):
+    """
+    Text placement computed once in the raw image's pixels (design_size)
+    and mapped through a crop box and one uniform scale when drawn, so
+    every export size shares fonts and spacing.
+    """
+    design_size: tuple
+    lines: list           # haiku lines
+    center_y: float       # where the design wants the middle of the haiku
+    line_height: int
+    main_font: tuple      # (path, size)
+    footer_text: str
+    footer_margin: int    # footer baseline, up from the bottom edge
+    footer_font: tuple    # (path, size)
+    text_rgb: tuple
+    shadow_rgb: tuple
+    shadow_strength: int
 
+def _place_lines(lines, center_y, line_h, h):
+    """Top y of each line, with the haiku block kept clear of the edges and footer of an h-tall area."""
+    total_h = len(lines) * line_h
     margin = int(h * 0.1)
     min_y = margin + (total_h // 2)
     max_y = h - margin - (total_h // 2) - int(h * 0.05)
     center_y = max(min_y, min(center_y, max_y))
 
     start_y = center_y - (total_h // 2)
+    return [start_y + i * line_h for i in range(len(lines))]
+
+def layout_poster(size, haiku: str, block_num: int, design) -> PosterLayout:
+    w, h = size
+
+    ref_dim = min(w, h)
+    base_size = int(ref_dim * 0.045)
+
+    main_font = (pick_font(design.font_vibe), base_size)
+    footer_font = (pick_font("sans"), int(base_size * 0.6))
+
+    lines = [l.strip() for l in haiku.split('\n') if l.strip()]
+    if not lines: lines = ["No Haiku"]
+
+    return PosterLayout(
+        design_size=(w, h),
+        lines=lines,
+        center_y=int(h * (design.y_position_percent / 100)),
+        line_height=int(base_size * 1.4),
+        main_font=main_font,
+        footer_text=f"Mochimo Block #{block_num}",
+        footer_margin=int(h * 0.05),
+        footer_font=footer_font,
+        text_rgb=hex_to_rgb(design.text_color_hex),
+        shadow_rgb=hex_to_rgb(design.shadow_color_hex),
+        shadow_strength=design.shadow_strength,
+    )
+
+def draw_layout(img: Image.Image, layout: PosterLayout, box=None) -> Image.Image:
+    """
+    Draws a layout onto img (in place), where img shows the box region of
+    the design (default: all of it, see crop_box) at any resolution.
+    """
+    w, h = img.size
+    left, top, right, bottom = box or (0, 0) + layout.design_size
+    crop_h = bottom - top
+    # One scale for type, glow and positions, so spacing never distorts
+    scale = w / (right - left)
+
+    font_main = font_for(layout.main_font[0], max(1, round(layout.main_font[1] * scale)))
+    font_footer = font_for(layout.footer_font[0], max(1, round(layout.footer_font[1] * scale)))
     center_x = w // 2
 
-    txt_rgb = hex_to_rgb(design.text_color_hex)
-    shadow_rgb = hex_to_rgb(design.shadow_color_hex)
+    # Placed within the crop, so the haiku stays over the same image content where it fits
+    tops = _place_lines(layout.lines, layout.center_y - top, layout.line_height, crop_h)
 
-    curr_y = start_y
-    for line in lines:
-        draw = ImageDraw.Draw(img)
+    draw = ImageDraw.Draw(img)
+    for line, y in zip(layout.lines, tops):
         bbox = draw.textbbox((0, 0), line, font=font_main)
         lw = bbox[2] - bbox[0]
         lx = center_x - (lw // 2)
-        img = draw_text_with_glow(img, lx, curr_y, line, font_main, txt_rgb, shadow_rgb, design.shadow_strength)
-        curr_y += line_h
+        img = draw_text_with_glow(img, lx, round(y * scale), line, font_main, layout.text_rgb, layout.shadow_rgb,
+                                  layout.shadow_strength, scale)
 
-    block_txt = f"Mochimo Block #{block_num}"
-    b_bbox = draw.textbbox((0,0), block_txt, font=font_footer)
+    b_bbox = draw.textbbox((0,0), layout.footer_text, font=font_footer)
     bw = b_bbox[2] - b_bbox[0]
     bx = center_x - (bw // 2)
-    by = h - int(h * 0.05)
+    by = round((crop_h - layout.footer_margin) * scale)
 
-    img = draw_text_with_glow(img, bx, by, block_txt, font_footer, (220,220,220), (0,0,0), 120)
+    img = draw_text_with_glow(img, bx, by, layout.footer_text, font_footer, (220,220,220), (0,0,0), 120, scale)
     return img
+
+def _render_target(img, layout, target):
+    size = target_size(target, img.size)
+    box = crop_box(img.size, size)
+    return draw_layout(resample_for(img, size, box), layout, box)
+
+def render_poster(img: Image.Image, haiku: str, block_num: int, design, copy: bool = True, targets=None, workers=None,
+                  finish=None):
+    """
+    Composites the haiku onto img. Pass copy=False when the caller no longer
+    needs the raw image, to draw in place and skip one full-size copy.
+
+    With targets (a list of Target), returns one poster per target instead,
+    in the same order: the layout is computed once, the raw image is
+    resampled once per size and the text is drawn fresh at that size, so
+    small exports stay sharp. Targets render in parallel threads; img is
+    left untouched. finish(target, poster), if given, runs in the same
+    thread as soon as a target is drawn and its result is returned in
+    place of the poster, so e.g. encoding never holds every size at once.
+    """
+    print("4. Applying holistic render...")
+    layout = layout_poster(img.size, haiku, block_num, design)
+    if targets is None:
+        if copy: img = img.copy()
+        return draw_layout(img, layout)
+
+    def render(target):
+        poster = _render_target(img, layout, target)
+        return finish(target, poster) if finish else poster
+
+    targets = list(targets)
+    if len(targets) <= 1 or workers == 1:
+        return [render(t) for t in targets]
+    with ThreadPoolExecutor(max_workers=workers or min(len(targets), os.cpu_count() or 1)) as pool:
+        return list(pool.map(render, targets))
@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from .painter import render_poster, warm_fonts
+from .storage import encode_png, encode_image
+from .memory import peak_rss
+
+def build_pnginfo(fields: dict) -> PngInfo:
+    info = PngInfo()
+    for key, value in fields.items():
+        info.add_text(key, str(value))
+    return info
+
+def render_variants(img, haiku, block_num, design, targets, pnginfo=None, workers=None):
+    """
+    Renders every export target (see painter.Target) from the raw image and
+    encodes each one as soon as it is drawn, in parallel threads (Pillow's
+    encoders release the GIL), so at most one poster per thread is alive.
+    Returns [(target, bytes)] in target order; img is left untouched.
+    """
+    targets = list(targets)
+    if not targets: return []
+    encoded = render_poster(img, haiku, block_num, design, targets=targets, workers=workers,
+                            finish=lambda target, poster: encode_image(poster, target.format, target.quality, pnginfo))
+    return list(zip(targets, encoded))
+
+def _init_worker(cwd):
+    # Fonts are resolved relative to the working directory (assets/fonts)
+    os.chdir(cwd)
+    warm_fonts()
+
+def _render_job(shm_name, size, haiku, block_num, design, fields, encode_raw, targets=()):
+    """
+    Runs in a worker process. The raw image arrives through shared memory,
+    so only the handle crosses the process boundary; the result goes back
+    as ready-to-write bytes (raw, poster, [(target, variant)]) plus the
+    worker's peak RSS for the memory report.
+    """
+    try:
+        # The parent owns the segment; keep this process's tracker out of it (3.13+)
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # Before 3.13 attaching registers the segment too, and the tracker
+        # would warn about (and try to unlink) it when the worker exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        view = Image.frombuffer("RGBA", size, shm.buf, "raw", "RGBA", 0, 1)
+        img = view.copy()
+        del view  # release the buffer export so the segment can be closed
+    finally:
+        shm.close()
+    pnginfo = build_pnginfo(fields)
+    raw_bytes = encode_png(img, pnginfo) if encode_raw else None
+    # Variants resample the raw image, so they go before the in-place render
+    variants = render_variants(img, haiku, block_num, design, targets, pnginfo)
+    poster = render_poster(img, haiku, block_num, design, copy=False)
+    del img
+    return raw_bytes, encode_png(poster, pnginfo), variants, peak_rss()
+
+class RenderService:
+    """
+    Process pool for the CPU-bound tail of the pipeline (render_poster plus
+    PNG encoding), so it scales across cores instead of sharing the GIL.
+
+        service = RenderService(workers=4)
+        future = service.submit(img, haiku, block_num, design, {"Block": ...})
+        raw_bytes, poster_bytes, variants, worker_rss = future.result()
+
+    Workers are started up front with the font registry already loaded.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(os.getcwd(),))
+        # Spawn every worker now so the first batch does not pay for startup
+        for future in [self.pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, img, haiku, block_num, design, fields, encode_raw=True, targets=()):
+        img = img if img.mode == "RGBA" else img.convert("RGBA")
+        shm = shared_memory.SharedMemory(create=True, size=img.width * img.height * 4)
+        # Paste straight into the segment rather than through tobytes(), which
+        # would hold one more full copy. frombuffer() views are read-only
+        # (writes would go to a private copy) unless told otherwise.
+        view = Image.frombuffer("RGBA", img.size, shm.buf, "raw", "RGBA", 0, 1)
+        view.readonly = 0
+        view.paste(img)
+        del view  # release the buffer export so the segment can be closed
+
+        try:
+            future = self.pool.submit(_render_job, shm.name, img.size, haiku, block_num, design, fields, encode_raw, tuple(targets))
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+        def _release(_):
+            shm.close()
+            shm.unlink()
+        future.add_done_callback(_release)
+        return future
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,67 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one upstream call.
+    Callers that arrive while it is in flight wait for, and share, its
+    result (or exception). Results are then kept for ttl seconds.
+
+        haiku_flight = SingleFlight(ttl=600, cache_if=bool)
+        haiku = haiku_flight.do(("haiku", 880030), fetch_haiku, 880030)
+
+    cache_if decides which results are worth keeping (e.g. skip the empty
+    haiku of a block that is not mined yet); in-flight sharing applies to
+    every result. Safe to use from Flask's request threads.
+    """
+
+    def __init__(self, ttl=0, max_entries=1024, cache_if=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_if = cache_if
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = OrderedDict()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                expires, value = hit
+                if expires > time.monotonic():
+                    self._cache.move_to_end(key)
+                    return value
+                del self._cache[key]
+
+            future = self._calls.get(key)
+            leader = future is None
+            if leader: future = self._calls[key] = Future()
+
+        if not leader: return future.result()
+
+        try:
+            value = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock: del self._calls[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._calls[key]
+            if self.ttl > 0 and (self.cache_if is None or self.cache_if(value)):
+                self._cache[key] = (time.monotonic() + self.ttl, value)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def forget(self, key):
+        """Drops a cached result so the next call goes upstream again."""
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
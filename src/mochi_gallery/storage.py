@@ -0,0 +1,423 @@
+import os
+import io
+import re
+import json
+import time
+import struct
+import hashlib
+import threading
+
+CONFIG_NAME = ".mochi.json"
+LAYOUTS = ("flat", "block", "date")
+SHARD_SIZE = 1000
+
+BLOB_DIR = "blobs"
+MOSAIC_DIR = "mosaics"
+VARIANT_DIR = "variants"
+GALLERY_DATA_DIR = "gallery-data"
+STATIC_DIR = "static"
+
+# Subdirectories of the output folder that never hold gallery posters
+RESERVED_DIRS = {"raw", "deleted", BLOB_DIR, MOSAIC_DIR, VARIANT_DIR, GALLERY_DATA_DIR, STATIC_DIR}
+
+FORMAT_EXTS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+# Per-directory list of purged file names (see purge_file)
+PURGE_LEDGER = ".purged"
+
+BLOCK_NUM_RE = re.compile(r"(?:block|raw)_(\d+)")
+
+# "name_<n>" stems as write_unique numbers them
+COUNTER_STEM_RE = re.compile(r"^(?P<base>.*)_(?P<n>\d+)$")
+
+# Per directory: {(base, ext): highest counter taken}, built from one listing
+_name_index = {}
+_name_index_lock = threading.Lock()
+
+def encode_png(img, pnginfo=None) -> bytes:
+    """Encodes a PIL image to PNG bytes (with optional PngInfo text chunks)."""
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", pnginfo=pnginfo)
+    return buf.getvalue()
+
+def encode_image(img, fmt="png", quality=90, pnginfo=None) -> bytes:
+    """Encodes to png, jpeg or webp bytes; only PNG carries the PngInfo metadata."""
+    if fmt == "png": return encode_png(img, pnginfo)
+    buf = io.BytesIO()
+    if fmt == "jpeg": img.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else: img.save(buf, format="WEBP", quality=quality, method=4)
+    return buf.getvalue()
+
+def variant_dir_for(output_dir, poster_dir):
+    """Variants mirror the poster's directory under output/variants/."""
+    rel = os.path.relpath(poster_dir, output_dir)
+    return os.path.join(output_dir, VARIANT_DIR) if rel == os.curdir else os.path.join(output_dir, VARIANT_DIR, rel)
+
+def remove_files(output_dir, rel_paths):
+    """Purges output-relative paths that exist (e.g. the variants of purged posters)."""
+    for rel_path in rel_paths:
+        purge_file(os.path.join(output_dir, *rel_path.split('/')))
+
+def unlink_files(directory, names):
+    """
+    Deletes derived files (gallery data chunks, old viewer assets) that may
+    already be gone. No purge ledger: write_unique never hands out their names.
+    """
+    for name in names:
+        try: os.unlink(os.path.join(directory, name))
+        except FileNotFoundError: pass
+
+def png_size(data: bytes):
+    """(width, height) from a PNG's IHDR chunk, without decoding it."""
+    return struct.unpack(">II", data[16:24])
+
+def _note_name(index, name):
+    """Records name in a directory index under both readings of its stem."""
+    stem, ext = os.path.splitext(name)
+    # "block_1.png" is counter 0 of "block_1" and counter 1 of "block"
+    index[(stem, ext)] = max(index.get((stem, ext), -1), 0)
+    match = COUNTER_STEM_RE.match(stem)
+    if match:
+        key = (match.group("base"), ext)
+        index[key] = max(index.get(key, -1), int(match.group("n")))
+
+def _directory_index(directory):
+    """
+    {(base, ext): highest counter taken} for a directory, built from one
+    listing plus its purge ledger on first use and then kept up to date as
+    names are claimed. 0 means the bare name ("block_1.png"), n means
+    "block_1_<n>.png". Call with _name_index_lock held.
+    """
+    key = os.path.abspath(directory)
+    index = _name_index.get(key)
+    if index is not None: return index
+    index = {}
+    try:
+        with os.scandir(directory) as entries:
+            names = [entry.name for entry in entries]
+    except FileNotFoundError:
+        names = []
+    if PURGE_LEDGER in names:
+        with open(os.path.join(directory, PURGE_LEDGER), "r", encoding="utf-8") as f:
+            names += f.read().splitlines()
+    for name in names: _note_name(index, name)
+    _name_index[key] = index
+    return index
+
+def purge_file(path):
+    """
+    Permanently removes a file and records its name in the directory's
+    purge ledger, so write_unique never hands the name out again (browsers
+    may hold the old bytes as immutable). Returns False if it was missing.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    with open(os.path.join(os.path.dirname(path), PURGE_LEDGER), "a", encoding="utf-8") as f:
+        f.write(os.path.basename(path) + "\n")
+    return True
+
+def _candidate(directory, base, ext, counter):
+    name = f"{base}{ext}" if counter == 0 else f"{base}_{counter}{ext}"
+    return os.path.join(directory, name)
+
+def _write_exclusive(path, data):
+    """Creates path with O_EXCL and writes data. Raises FileExistsError if taken."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    except Exception:
+        os.unlink(path)
+        raise
+
+def _claim(path, data, store=None):
+    """
+    Creates path exclusively. With a blob store, path becomes a hard link to
+    the content-addressed blob, so identical bytes are stored (and written)
+    only once. Raises FileExistsError if path is taken.
+    """
+    if store is None: return _write_exclusive(path, data)
+    while True:
+        blob = put_blob(store, data)
+        try:
+            os.link(blob, path)
+            return
+        except FileExistsError:
+            raise
+        except FileNotFoundError:
+            # Collected by a concurrent gc between put and link; store again
+            if os.path.isdir(os.path.dirname(path) or "."): continue
+            raise
+        except OSError:
+            # Filesystem without hard links: fall back to a private copy
+            return _write_exclusive(path, data)
+
+def _write_counter(directory, filename, data, reserved_dirs=(), store=None):
+    base, ext = os.path.splitext(filename)
+    while True:
+        with _name_index_lock:
+            index = _directory_index(directory)
+            counter = 1 + max(_directory_index(d).get((base, ext), -1) for d in [directory, *reserved_dirs])
+            _note_name(index, os.path.basename(_candidate(directory, base, ext, counter)))
+        path = _candidate(directory, base, ext, counter)
+        try:
+            _claim(path, data, store)
+            return path, True
+        except FileExistsError:
+            # Another process claimed it first; move on to the next number
+            continue
+
+def _write_hashed(directory, filename, data, store=None):
+    base, ext = os.path.splitext(filename)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    path = os.path.join(directory, f"{base}_{digest}{ext}")
+    if os.path.exists(path): return path, False
+    try:
+        _claim(path, data, store)
+        return path, True
+    except FileExistsError:
+        # Identical bytes already saved under this name: dedupe
+        return path, False
+
+def write_unique(directory, filename, data: bytes, naming: str = "counter", reserved_dirs=(), store=None):
+    """
+    Atomically writes data to a fresh path derived from filename.
+
+    naming="counter": "name.png", "name_1.png", ... Taken numbers are indexed
+        per directory from a single listing, so each save is O(1) instead of
+        an exists() probe per taken name; O_EXCL creation keeps concurrent
+        writers from landing on the same path.
+    naming="hash": "name_<sha256 prefix>.png". Identical outputs map to the
+        same file and are written only once.
+
+    Names found in reserved_dirs (e.g. the trash), or purged from any of
+    these directories (see purge_file), are never reused, so a path always
+    refers to the same bytes and can be cached as immutable.
+
+    With store (the output root, see put_blob), the file is a hard link into
+    the content-addressed blob store instead of a fresh copy.
+
+    Returns (path, created). created is False when a hash-named file with
+    the same content already existed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if naming == "hash": return _write_hashed(directory, filename, data, store)
+    return _write_counter(directory, filename, data, reserved_dirs, store)
+
+def store_for(output_dir):
+    """The blob store root to pass to write_unique, or None if CAS is off."""
+    return output_dir if load_config(output_dir).get("cas") else None
+
+# --- CONTENT-ADDRESSED BLOB STORE ---
+# Blobs live in output/blobs/<aa>/<bb>/<sha256>.png. Gallery files (posters,
+# raw images, trash) are hard links to them, so listing, serving and soft
+# delete work unchanged. A blob's reference count is its link count minus
+# one; blobs nobody links to any more are removed by gc_blobs().
+
+def blob_path(store, digest, ext=".png"):
+    return os.path.join(store, BLOB_DIR, digest[:2], digest[2:4], digest + ext)
+
+def put_blob(store, data: bytes, ext=".png"):
+    """Stores data under its SHA-256 (once) and returns the blob path."""
+    path = blob_path(store, hashlib.sha256(data).hexdigest(), ext)
+    if os.path.exists(path): return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+def write_atomic(path, chunks):
+    """
+    Writes an iterable of str chunks to path through a temp file and
+    os.replace, so readers see either the old file or the new one, never a
+    partial write.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except FileNotFoundError: pass
+        raise
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def import_into_store(output_dir):
+    """
+    Converts an existing gallery to the blob store: every PNG (posters, raw,
+    trash) is replaced by a hard link to its blob, collapsing duplicates.
+    Mosaics are left alone: they are rebuilt under the same names, which
+    must never write through a shared inode. Returns (files, bytes_saved).
+    """
+    files, saved = 0, 0
+    for rel_path, entry in list(iter_files(output_dir, skip_dirs={BLOB_DIR, MOSAIC_DIR})):
+        if not entry.name.endswith(".png"): continue
+        st = entry.stat()
+        blob = blob_path(output_dir, _hash_file(entry.path))
+        if os.path.exists(blob):
+            if os.path.samefile(blob, entry.path): continue
+            # Duplicate content: swap the copy for a link to the blob
+            tmp_path = entry.path + ".link.tmp"
+            os.link(blob, tmp_path)
+            os.replace(tmp_path, entry.path)
+            saved += st.st_size
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(entry.path, blob)
+        files += 1
+    save_config(output_dir, cas=True)
+    return files, saved
+
+def purge_trash(output_dir, older_than_days=None):
+    """
+    Permanently removes soft-deleted files (optionally only old ones).
+    Returns their paths relative to the trash, i.e. their gallery paths.
+    """
+    trash = os.path.join(output_dir, "deleted")
+    cutoff = time.time() - older_than_days * 86400 if older_than_days is not None else None
+    removed = []
+    for rel_path, entry in list(iter_files(trash)):
+        if entry.name == PURGE_LEDGER: continue
+        # The move into the trash updates ctime, so it dates the deletion
+        if cutoff is not None and entry.stat().st_ctime > cutoff: continue
+        purge_file(entry.path)
+        removed.append(rel_path)
+    return removed
+
+def gc_blobs(output_dir):
+    """Deletes blobs no gallery file links to. Returns (blobs, bytes) freed."""
+    freed, freed_bytes = 0, 0
+    for rel_path, entry in list(iter_files(os.path.join(output_dir, BLOB_DIR))):
+        st = entry.stat()
+        if entry.name.endswith(".tmp") and time.time() - st.st_mtime < 3600: continue
+        if st.st_nlink <= 1:
+            os.unlink(entry.path)
+            freed += 1
+            freed_bytes += st.st_size
+    _prune_empty_dirs(os.path.join(output_dir, BLOB_DIR))
+    return freed, freed_bytes
+
+# --- OUTPUT LAYOUT ---
+
+def load_config(output_dir):
+    """Reads the per-gallery settings file (layout etc), with defaults."""
+    config = {"layout": "flat"}
+    try:
+        with open(os.path.join(output_dir, CONFIG_NAME), 'r') as f:
+            config.update(json.load(f))
+    except (FileNotFoundError, ValueError):
+        pass
+    return config
+
+def save_config(output_dir, **updates):
+    config = load_config(output_dir)
+    config.update(updates)
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = os.path.join(output_dir, CONFIG_NAME + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, CONFIG_NAME))
+    return config
+
+def shard_for(layout, block_num, timestamp=None):
+    """
+    Relative subdirectory for a file under the given layout:
+        flat  -> ""          (everything in one directory)
+        block -> "880"       (block // 1000)
+        date  -> "2025-06"   (year-month of creation)
+    """
+    if layout == "block": return str(int(block_num) // SHARD_SIZE)
+    if layout == "date": return time.strftime("%Y-%m", time.localtime(timestamp))
+    return ""
+
+def output_dirs(output_dir, block_num, layout=None):
+    """Returns (poster_dir, raw_dir) for a block under the gallery's layout."""
+    layout = layout or load_config(output_dir)["layout"]
+    shard = shard_for(layout, block_num)
+    return os.path.join(output_dir, shard), os.path.join(output_dir, "raw", shard)
+
+def trash_dir_for(output_dir, poster_dir):
+    """The trash folder mirroring poster_dir (see /delete)."""
+    return os.path.normpath(os.path.join(output_dir, "deleted", os.path.relpath(poster_dir, output_dir)))
+
+def iter_files(root, skip_dirs=()):
+    """
+    Yields (relative_path, DirEntry) for files under root, descending into
+    shard subdirectories. Relative paths always use '/' so they can be used
+    directly in URLs.
+    """
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel_dir))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if not rel_dir and entry.name in skip_dirs: continue
+                    if entry.name.startswith('.'): continue
+                    stack.append(rel_path)
+                elif entry.is_file():
+                    yield rel_path, entry
+
+def safe_relpath(rel_path):
+    """
+    Normalizes a client-supplied relative path. Returns None for anything
+    that could escape the output directory.
+    """
+    if not rel_path or '\\' in rel_path or rel_path.startswith('/'): return None
+    parts = rel_path.split('/')
+    if any(p in ('', '.', '..') for p in parts): return None
+    return '/'.join(parts)
+
+def migrate_layout(output_dir, layout):
+    """
+    Moves existing posters and raw images into the given layout (in either
+    direction) and records it as the gallery's layout. Returns the list of
+    (old, new) paths relative to output_dir.
+    """
+    if layout not in LAYOUTS: raise ValueError(f"Unknown layout '{layout}'")
+    moved = []
+    for root, skip in ((output_dir, RESERVED_DIRS), (os.path.join(output_dir, "raw"), ())):
+        root_rel = os.path.relpath(root, output_dir).replace(os.sep, '/')
+        root_prefix = "" if root_rel == "." else root_rel + "/"
+        for rel_path, entry in list(iter_files(root, skip_dirs=skip)):
+            match = BLOCK_NUM_RE.search(entry.name)
+            if not match or not entry.name.endswith(".png"): continue
+            shard = shard_for(layout, match.group(1), entry.stat().st_mtime)
+            dst_dir = os.path.join(root, shard)
+            dst_path = os.path.join(dst_dir, entry.name)
+            if os.path.abspath(dst_path) == os.path.abspath(entry.path): continue
+            if os.path.exists(dst_path):
+                print(f"     [WARN] {dst_path} already exists, leaving {rel_path} in place")
+                continue
+            os.makedirs(dst_dir, exist_ok=True)
+            os.rename(entry.path, dst_path)
+            new_rel = f"{shard}/{entry.name}" if shard else entry.name
+            moved.append((root_prefix + rel_path, root_prefix + new_rel))
+    _prune_empty_dirs(output_dir)
+    save_config(output_dir, layout=layout)
+    return moved
+
+def _prune_empty_dirs(output_dir):
+    for dirpath, dirnames, filenames in os.walk(output_dir, topdown=False):
+        if dirpath == output_dir or os.path.basename(dirpath) in RESERVED_DIRS: continue
+        if not dirnames and not filenames:
+            try: os.rmdir(dirpath)
+            except OSError: pass